@@ -1,3 +1,31 @@
-from .tm import Time, auto_parse, now
-from .obj import Object
-from .weather import Weather
+"""Astronomical calculations of the ART bot.
+
+The public names are imported on first use, so importing ``art`` (or one of
+its light modules such as ``art.catalog`` or ``art.analytics``) does not load
+astropy, astroplan or matplotlib.
+"""
+import importlib
+
+_exports = {
+    "Time": "tm",
+    "auto_parse": "tm",
+    "now": "tm",
+    "Object": "obj",
+    "ObjectCollection": "obj",
+    "Weather": "weather",
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name: str):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(f".{_exports[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
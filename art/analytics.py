@@ -0,0 +1,215 @@
+"""Incremental request analytics.
+
+Aggregates are kept in their own SQLite file (``ART_ANALYTICS_DB``) and
+updated from the request log, which is opened read-only, so the bot's writes
+are never blocked. Only rows above the last processed ``Request.id`` are read.
+
+    python -m art.analytics update
+    python -m art.analytics hourly|targets|sites [--limit N] [--format csv|json] [--output FILE]
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+from collections import Counter
+
+from peewee import (Model, SqliteDatabase, CharField, DateTimeField, FloatField, IntegerField, CompositeKey,
+                    EXCLUDED, fn)
+
+from .audit import SCHEMA, Request
+
+logger = logging.getLogger(__name__)
+
+db = SqliteDatabase(os.environ.get("ART_ANALYTICS_DB", "analytics.db"), pragmas={"journal_mode": "wal"})
+
+# Decimal places targets (hours/degrees) and sites (degrees) are grouped by
+TARGET_PRECISION = 4
+SITE_PRECISION = 2
+
+
+class Watermark(Model):
+    name = CharField(primary_key=True)
+    value = IntegerField()
+
+    class Meta:
+        database = db
+
+
+class Hourly(Model):
+    hour = DateTimeField()
+    operation = CharField()
+    requests = IntegerField()
+
+    class Meta:
+        database = db
+        primary_key = CompositeKey("hour", "operation")
+
+
+class Target(Model):
+    ra = FloatField()
+    dec = FloatField()
+    requests = IntegerField()
+
+    class Meta:
+        database = db
+        primary_key = CompositeKey("ra", "dec")
+
+
+class Site(Model):
+    latitude = FloatField()
+    longitude = FloatField()
+    requests = IntegerField()
+
+    class Meta:
+        database = db
+        primary_key = CompositeKey("latitude", "longitude")
+
+
+def raw(path: str = None) -> SqliteDatabase:
+    path = path or os.environ.get("ART_LOG_DB", "requests.db")
+    return SqliteDatabase(f"file:{path}?mode=ro", uri=True)
+
+
+def _targets(inputs: str):
+    try:
+        data = json.loads(inputs)
+        ras, decs = data.get("ra"), data.get("dec")
+    except (ValueError, AttributeError):
+        return []
+    # Single targets are logged as numbers rather than lists
+    if isinstance(ras, (int, float)) and isinstance(decs, (int, float)):
+        ras, decs = [ras], [decs]
+    if not isinstance(ras, list) or not isinstance(decs, list):
+        return []
+
+    return [(round(ra, TARGET_PRECISION), round(dec, TARGET_PRECISION)) for ra, dec in zip(ras, decs)
+            if isinstance(ra, (int, float)) and isinstance(dec, (int, float))]
+
+
+def _add(model, counts: Counter, keys: list) -> None:
+    rows = [dict(zip(keys, key), requests=count) for key, count in counts.items()]
+    for i in range(0, len(rows), 100):
+        (model
+         .insert_many(rows[i:i + 100])
+         .on_conflict(conflict_target=[getattr(model, key) for key in keys],
+                      update={model.requests: model.requests + EXCLUDED.requests})
+         .execute())
+
+
+def watermark():
+    """The last request id folded into the aggregates, None when there are no aggregates."""
+    if not os.path.exists(db.database) or not Watermark.table_exists():
+        return None
+
+    mark = Watermark.get_or_none(Watermark.name == "request")
+    return mark.value if mark is not None else 0
+
+
+def update(source: SqliteDatabase = None, batch: int = 5000) -> int:
+    """Fold request log rows added since the last run into the aggregates. Returns the number of rows.
+
+    Raises ``RuntimeError`` when the request log was not migrated to ``audit.SCHEMA`` yet.
+    """
+    source = source or raw()
+    version = source.pragma("user_version")
+    if version < SCHEMA:
+        raise RuntimeError(f"The request log has schema {version}, {SCHEMA} is needed. "
+                           f"Run python -m art.audit migrate first")
+
+    db.create_tables([Watermark, Hourly, Target, Site])
+    mark = Watermark.get_or_none(Watermark.name == "request")
+    last = mark.value if mark is not None else 0
+
+    total = 0
+    with source.bind_ctx([Request]):
+        # Ids only restart when the request log was replaced
+        top = Request.select(fn.MAX(Request.id)).scalar() or 0
+        if top < last:
+            logger.warning("Request ids restarted below %d, counting from the beginning", last)
+            last = 0
+
+        while True:
+            rows = list(Request
+                        .select(Request.id, Request.created_on, Request.operation, Request.inputs,
+                                Request.latitude, Request.longitude)
+                        .where(Request.id > last)
+                        .order_by(Request.id)
+                        .limit(batch)
+                        .tuples())
+            if not rows:
+                break
+
+            hourly, targets, sites = Counter(), Counter(), Counter()
+            for _, created_on, operation, inputs, latitude, longitude in rows:
+                hourly[(created_on.replace(minute=0, second=0, microsecond=0), operation)] += 1
+                targets.update(_targets(inputs))
+                if latitude is not None and longitude is not None:
+                    sites[(round(latitude, SITE_PRECISION), round(longitude, SITE_PRECISION))] += 1
+
+            last = rows[-1][0]
+            with db.atomic():
+                _add(Hourly, hourly, ["hour", "operation"])
+                _add(Target, targets, ["ra", "dec"])
+                _add(Site, sites, ["latitude", "longitude"])
+                Watermark.replace(name="request", value=last).execute()
+            total += len(rows)
+
+    return total
+
+
+def hourly(operation: str = None, limit: int = None) -> list:
+    query = Hourly.select().order_by(Hourly.hour.desc(), Hourly.operation)
+    if operation is not None:
+        query = query.where(Hourly.operation == operation)
+    return [{**row, "hour": row["hour"].strftime("%Y-%m-%d %H:00")} for row in query.limit(limit).dicts()]
+
+
+def targets(limit: int = 10) -> list:
+    return list(Target.select().order_by(Target.requests.desc()).limit(limit).dicts())
+
+
+def sites(limit: int = 10) -> list:
+    return list(Site.select().order_by(Site.requests.desc()).limit(limit).dicts())
+
+
+def export(rows: list, fmt: str, output) -> None:
+    if fmt == "json":
+        json.dump(rows, output, indent=2)
+        output.write("\n")
+        return
+
+    if rows:
+        writer = csv.DictWriter(output, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m art.analytics")
+    parser.add_argument("report", choices=["update", "hourly", "targets", "sites"])
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--operation", default=None, help="only this operation in the hourly report")
+    parser.add_argument("--format", choices=["csv", "json"], default="csv")
+    parser.add_argument("--output", default=None, help="file to write instead of stdout")
+    args = parser.parse_args()
+
+    try:
+        processed = update()
+    except RuntimeError as e:
+        sys.exit(str(e))
+    if args.report == "update":
+        print(processed)
+        sys.exit()
+
+    if args.report == "hourly":
+        result = hourly(args.operation, args.limit)
+    else:
+        result = {"targets": targets, "sites": sites}[args.report](args.limit or 10)
+
+    if args.output is None:
+        export(result, args.format, sys.stdout)
+    else:
+        with open(args.output, "w", newline="") as f:
+            export(result, args.format, f)
@@ -0,0 +1,353 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+from time import monotonic
+
+import dateutil.parser
+from peewee import (Model, SqliteDatabase, BigIntegerField, CharField, DateField, DateTimeField, FloatField,
+                    IntegerField, TextField, CompositeKey, EXCLUDED, PeeweeException, chunked, fn)
+from playhouse.migrate import SqliteMigrator, migrate as apply
+from playhouse.sqlite_ext import AutoIncrementField
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+db = SqliteDatabase(os.environ.get("ART_LOG_DB", "requests.db"), pragmas={
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -8 * 1024,
+    "busy_timeout": 5000,
+})
+
+
+# Bumped together with a new step in ``migrate``
+SCHEMA = 3
+
+
+class Request(Model):
+    # Ids are never reused after old rows are deleted, so readers can resume above the last one they saw
+    id = AutoIncrementField()
+    created_on = DateTimeField()
+    created_by = BigIntegerField()
+    operation = CharField()
+    inputs = TextField()
+    output = TextField()
+    time = DateTimeField(null=True)
+    latitude = FloatField(null=True)
+    longitude = FloatField(null=True)
+    ra = FloatField(null=True)
+    dec = FloatField(null=True)
+
+    class Meta:
+        database = db
+        indexes = (
+            (("created_by", "created_on"), False),
+            (("operation", "created_on"), False),
+        )
+
+
+class DailyRollup(Model):
+    day = DateField()
+    operation = CharField()
+    requests = IntegerField()
+    users = IntegerField()
+
+    class Meta:
+        database = db
+        primary_key = CompositeKey("day", "operation")
+
+
+class DailyUser(Model):
+    """Users seen per day and operation, so ``DailyRollup.users`` stays distinct over several rollups.
+
+    Rows are deleted once no request of their day is left to roll up.
+    """
+    day = DateField()
+    operation = CharField()
+    user = BigIntegerField()
+
+    class Meta:
+        database = db
+        primary_key = CompositeKey("day", "operation", "user")
+
+
+def typed(inputs: str) -> dict:
+    """Typed columns of a request's JSON ``inputs``. ``ra``/``dec`` are those of the first target."""
+    try:
+        data = json.loads(inputs)
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+
+    columns = {
+        "latitude": data.get("lat", data.get("latitude")),
+        "longitude": data.get("lon", data.get("longitude")),
+    }
+    for key in ("ra", "dec"):
+        value = data.get(key)
+        if isinstance(value, list) and value:
+            columns[key] = value[0]
+        elif isinstance(value, (int, float)):
+            columns[key] = value
+        else:
+            columns[key] = None
+
+    try:
+        columns["time"] = dateutil.parser.parse(data["time"]).replace(tzinfo=None) if "time" in data else None
+    except (ValueError, OverflowError, TypeError):
+        columns["time"] = None
+
+    return columns
+
+
+def migrate() -> None:
+    """Create or upgrade the request log to ``SCHEMA``, tracked in ``PRAGMA user_version``."""
+    version = db.pragma("user_version")
+    if not Request.table_exists():
+        db.create_tables([Request, DailyRollup, DailyUser])
+        db.pragma("user_version", SCHEMA)
+        return
+
+    if version < 1:
+        migrator = SqliteMigrator(db)
+        with db.atomic():
+            apply(
+                migrator.alter_column_type("request", "created_by", BigIntegerField()),
+                migrator.add_column("request", "time", Request.time),
+                migrator.add_column("request", "latitude", Request.latitude),
+                migrator.add_column("request", "longitude", Request.longitude),
+                migrator.add_column("request", "ra", Request.ra),
+                migrator.add_column("request", "dec", Request.dec),
+                migrator.add_index("request", ("created_by", "created_on"), False),
+                migrator.add_index("request", ("operation", "created_on"), False),
+            )
+            rows = [Request(id=row.id, **typed(row.inputs)) for row in Request.select(Request.id, Request.inputs)]
+            Request.bulk_update(rows, [Request.time, Request.latitude, Request.longitude, Request.ra, Request.dec],
+                                batch_size=100)
+            db.create_tables([DailyRollup])
+
+    if version < 2:
+        # SQLite cannot add AUTOINCREMENT to a table, so it is copied into a new one
+        columns = ", ".join(f'"{field.column_name}"' for field in Request._meta.sorted_fields)
+        with db.atomic():
+            db.execute_sql('ALTER TABLE "request" RENAME TO "request_old"')
+            for index in db.get_indexes("request_old"):
+                db.execute_sql(f'DROP INDEX "{index.name}"')
+            db.create_tables([Request])
+            db.execute_sql(f'INSERT INTO "request" ({columns}) SELECT {columns} FROM "request_old"')
+            db.execute_sql('DROP TABLE "request_old"')
+
+    if version < 3:
+        with db.atomic():
+            db.create_tables([DailyUser])
+            # Integer coordinates used to be stored as NULL
+            rows = [Request(id=row.id, ra=columns.get("ra"), dec=columns.get("dec"))
+                    for row in Request.select(Request.id, Request.inputs).where(Request.ra.is_null())
+                    for columns in [typed(row.inputs)] if columns.get("ra") is not None]
+            Request.bulk_update(rows, [Request.ra, Request.dec], batch_size=100)
+
+    db.pragma("user_version", SCHEMA)
+
+
+def rollup(days: int = None) -> int:
+    """Fold requests older than ``days`` whole UTC days into ``DailyRollup`` and delete them.
+
+    ``users`` counts the distinct users of a day in ``DailyUser`` rather than
+    adding up those of each rollup, which may split a day; it is pruned to the
+    days still split. Once there are analytics aggregates, requests
+    ``analytics.update`` has not read yet are kept. Returns the number of
+    deleted requests. Defaults to ``ART_LOG_RETENTION_DAYS``.
+    """
+    # The analytics read this module's tables, so they are only imported when needed
+    from .analytics import watermark
+
+    days = days or int(os.environ.get("ART_LOG_RETENTION_DAYS", 90))
+    cutoff = datetime.combine(datetime.utcnow().date() - timedelta(days=days), datetime.min.time())
+    old = Request.created_on < cutoff
+    counted = watermark()
+    if counted is not None:
+        old &= Request.id <= counted
+    day = fn.date(Request.created_on)
+    seen = DailyUser.alias()
+    users = (seen
+             .select(fn.COUNT(seen.user))
+             .where((seen.day == day) & (seen.operation == Request.operation)))
+    query = (Request
+             .select(day, Request.operation, fn.COUNT(Request.id), users)
+             .where(old)
+             .group_by(day, Request.operation))
+
+    with db.atomic():
+        (DailyUser
+         .insert_from(Request.select(day, Request.operation, Request.created_by).where(old).distinct(),
+                      [DailyUser.day, DailyUser.operation, DailyUser.user])
+         .on_conflict_ignore()
+         .execute())
+        # Days rolled up before DailyUser existed keep their count if it is larger
+        (DailyRollup
+         .insert_from(query, [DailyRollup.day, DailyRollup.operation, DailyRollup.requests, DailyRollup.users])
+         .on_conflict(conflict_target=[DailyRollup.day, DailyRollup.operation],
+                      update={DailyRollup.requests: DailyRollup.requests + EXCLUDED.requests,
+                              DailyRollup.users: fn.MAX(DailyRollup.users, EXCLUDED.users)})
+         .execute())
+        deleted = Request.delete().where(old).execute()
+        # Later rollups only see days from the oldest request left on
+        keep = cutoff.date().isoformat()
+        oldest = Request.select(fn.MIN(day)).scalar()
+        if oldest is not None:
+            keep = min(keep, oldest)
+        DailyUser.delete().where(DailyUser.day < keep).execute()
+        return deleted
+
+
+class RequestLog:
+    """Bounded queue of ``Request`` rows written in bulk by one background task.
+
+    A batch is flushed once it holds ``batch`` rows or its oldest row waited
+    ``interval`` seconds. When the queue holds ``size`` rows ``policy`` decides
+    what ``put`` does: ``"block"`` waits for room, ``"drop"`` discards the row
+    and ``"spill"`` appends it to the ``spill`` file, which is loaded into the
+    database on the next ``start``. Defaults are read from ``ART_LOG_BATCH``,
+    ``ART_LOG_INTERVAL``, ``ART_LOG_QUEUE``, ``ART_LOG_POLICY`` and
+    ``ART_LOG_SPILL``. Every ``retention`` seconds (``ART_LOG_ROLLUP_INTERVAL``)
+    old requests are folded into daily rollups, see ``rollup``.
+    """
+
+    def __init__(self, batch: int = None, interval: float = None, size: int = None, policy: str = None,
+                 spill: str = None, retention: float = None) -> None:
+        self.batch = batch or int(os.environ.get("ART_LOG_BATCH", 256))
+        self.interval = interval or float(os.environ.get("ART_LOG_INTERVAL", 1))
+        self.size = size or int(os.environ.get("ART_LOG_QUEUE", 10000))
+        self.policy = policy or os.environ.get("ART_LOG_POLICY", "block")
+        self.spill = spill or os.environ.get("ART_LOG_SPILL", "requests.spill.jsonl")
+        self.retention = retention or float(os.environ.get("ART_LOG_ROLLUP_INTERVAL", 6 * 3600))
+        if self.policy not in ("block", "drop", "spill"):
+            raise ValueError(f"Unknown queue policy: {self.policy}")
+
+        self.stats = {"written": 0, "batches": 0, "dropped": 0, "spilled": 0}
+        self._queue = asyncio.Queue(self.size)
+        self._task = None
+        self._retention = None
+
+    def _write(self, rows: list) -> None:
+        rows = [{**row, **typed(row["inputs"])} for row in rows]
+        with db.atomic():
+            for chunk in chunked(rows, 100):
+                Request.insert_many(chunk).execute()
+
+    def _spill(self, rows: list) -> None:
+        with open(self.spill, "a") as f:
+            for row in rows:
+                f.write(json.dumps({**row, "created_on": row["created_on"].isoformat()}) + "\n")
+        self.stats["spilled"] += len(rows)
+
+    def _replay(self) -> None:
+        if not os.path.exists(self.spill):
+            return
+
+        with open(self.spill) as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        for row in rows:
+            row["created_on"] = datetime.fromisoformat(row["created_on"])
+        self._write(rows)
+        os.remove(self.spill)
+        logger.info("Loaded %d spilled requests", len(rows))
+
+    async def _flush(self, rows: list) -> None:
+        try:
+            await asyncio.to_thread(self._write, rows)
+            self.stats["written"] += len(rows)
+            self.stats["batches"] += 1
+        except PeeweeException:
+            logger.exception("Cannot write %d requests, spilling them", len(rows))
+            self._spill(rows)
+
+    async def _run(self) -> None:
+        closing = False
+        while not closing:
+            row = await self._queue.get()
+            if row is None:
+                break
+
+            rows = [row]
+            deadline = monotonic() + self.interval
+            while len(rows) < self.batch:
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), max(deadline - monotonic(), 0))
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    closing = True
+                    break
+                rows.append(row)
+
+            await self._flush(rows)
+
+    async def _retain(self) -> None:
+        while True:
+            try:
+                deleted = await asyncio.to_thread(rollup)
+                if deleted:
+                    logger.info("Rolled up %d requests", deleted)
+            except PeeweeException:
+                logger.exception("Cannot roll up old requests")
+            await asyncio.sleep(self.retention)
+
+    async def start(self) -> None:
+        try:
+            await asyncio.to_thread(self._replay)
+        except (OSError, ValueError, PeeweeException):
+            logger.exception("Cannot load spilled requests from %s", self.spill)
+
+        loop = asyncio.get_running_loop()
+        self._task = loop.create_task(self._run())
+        self._retention = loop.create_task(self._retain())
+
+    async def put(self, created_by, operation: str, inputs: str, output: str) -> None:
+        row = {
+            "created_on": datetime.utcnow(),
+            "created_by": created_by,
+            "operation": operation,
+            "inputs": inputs,
+            "output": output
+        }
+        if self.policy == "block":
+            await self._queue.put(row)
+            return
+
+        try:
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            if self.policy == "drop":
+                self.stats["dropped"] += 1
+            else:
+                self._spill([row])
+
+    async def close(self) -> None:
+        """Write everything queued so far and stop the writer."""
+        if self._task is None:
+            return
+
+        self._retention.cancel()
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+
+request_log = RequestLog()
+registry.track("art_request_log_total", request_log.stats)
+registry.gauge("art_queue_depth", request_log._queue.qsize, queue="request_log")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("migrate", "rollup"):
+        sys.exit("usage: python -m art.audit migrate | rollup [DAYS]")
+
+    migrate()
+    if sys.argv[1] == "rollup":
+        print(rollup(int(sys.argv[2]) if len(sys.argv) > 2 else None))
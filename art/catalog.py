@@ -0,0 +1,234 @@
+"""Offline object catalog.
+
+The bundled table holds the Messier objects and bright stars. The NGC and IC
+objects of OpenNGC (CC BY-SA 4.0) are added by downloading them once, which
+the catalog then loads instead::
+
+    python -m art.catalog fetch [DIRECTORY]
+    python -m art.catalog build SOURCE.csv DIRECTORY
+"""
+import csv
+import os
+import re
+import sys
+import tempfile
+from bisect import bisect_left
+from collections import defaultdict
+from difflib import get_close_matches
+from urllib.request import urlopen
+
+import numpy as np
+
+BUNDLED = os.path.join(os.path.dirname(__file__), "data", "catalog.csv")
+FETCHED = os.path.join(os.path.dirname(__file__), "data", "openngc")
+OPENNGC_URL = "https://raw.githubusercontent.com/mattiaverga/OpenNGC/master/database_files/NGC.csv"
+# Names typed with a typo are looked for among names at most this many characters longer or shorter
+FUZZY_LENGTH = 2
+
+
+def normalize(name: str) -> str:
+    return "".join(name.lower().split())
+
+
+def designation(name: str) -> str:
+    """``NGC0224`` as people write it, ``NGC 224``."""
+    match = re.fullmatch(r"(NGC|IC)\s*0*(\d+)(.*)", name.strip())
+    if match is None:
+        return name.strip()
+
+    return f"{match[1]} {match[2]}{match[3]}"
+
+
+def sexagesimal(text: str) -> float:
+    sign = -1 if text.strip().startswith("-") else 1
+    value = 0.0
+    for i, part in enumerate(text.strip().lstrip("+-").split(":")):
+        value += float(part) / 60 ** i
+    return sign * value
+
+
+class Catalog:
+    """Offline object table with an exact, prefix and typo-tolerant name index.
+
+    Coordinates are kept in an ``(N, 2)`` float64 array of RA (hours) and Dec
+    (degrees). A catalog written with ``save`` is opened memory-mapped.
+    """
+
+    def __init__(self, names: list, aliases: list, coords: np.ndarray) -> None:
+        self.names = names
+        self.coords = coords
+        self.index = {}
+        for row, (name, others) in enumerate(zip(names, aliases)):
+            for alias in [name] + others:
+                self.index.setdefault(normalize(alias), row)
+
+        self.keys = sorted(self.index)
+        # First character and length: keys, so a typo is only compared with names that could be close
+        self._similar = defaultdict(list)
+        for key in self.keys:
+            self._similar[key[:1], len(key)].append(key)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @staticmethod
+    def _read_names(path: str):
+        names, aliases, coords = [], [], []
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                names.append(row["name"])
+                aliases.append([each for each in row["aliases"].split("|") if each])
+                if "ra" in row:
+                    coords.append((float(row["ra"]), float(row["dec"])))
+
+        return names, aliases, coords
+
+    @classmethod
+    def from_csv(cls, path: str = BUNDLED):
+        names, aliases, coords = cls._read_names(path)
+        return cls(names, aliases, np.array(coords, dtype=np.float64).reshape(-1, 2))
+
+    @classmethod
+    def from_openngc(cls, path: str):
+        """Read OpenNGC's ``NGC.csv``. Duplicate entries become aliases, nonexistent objects are skipped."""
+        names, aliases, coords, duplicates = [], [], [], []
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f, delimiter=";"):
+                name = designation(row["Name"])
+                if row["Type"] == "Dup":
+                    duplicates.append((name, designation(row["NGC"] and "NGC" + row["NGC"] or "IC" + row["IC"])))
+                    continue
+                if not row["RA"] or not row["Dec"]:
+                    continue
+
+                others = [row["Name"]]
+                if row["M"]:
+                    others += [f"M{int(row['M'])}", f"Messier {int(row['M'])}"]
+                for column in ("Common names", "Identifiers"):
+                    others += [each.strip() for each in row[column].split(",") if each.strip()]
+                names.append(name)
+                aliases.append(others)
+                coords.append((sexagesimal(row["RA"]), sexagesimal(row["Dec"])))
+
+        rows = {name: i for i, name in enumerate(names)}
+        for name, primary in duplicates:
+            if primary in rows:
+                aliases[rows[primary]].append(name)
+
+        return cls(names, aliases, np.array(coords, dtype=np.float64).reshape(-1, 2))
+
+    def merge(self, other: "Catalog") -> "Catalog":
+        """This catalog followed by the objects of ``other``; objects it already has get their aliases."""
+        names, aliases, coords = list(self.names), [[] for _ in self.names], [np.asarray(self.coords)]
+        for key, row in self.index.items():
+            aliases[row].append(key)
+        others = defaultdict(list)
+        for key, row in other.index.items():
+            others[row].append(key)
+
+        rows = []
+        for row, name in enumerate(other.names):
+            known = self.index.get(normalize(name))
+            if known is None:
+                rows.append(row)
+            else:
+                aliases[known] += others[row]
+
+        names += [other.names[row] for row in rows]
+        aliases += [others[row] for row in rows]
+        coords.append(np.asarray(other.coords)[rows])
+        return Catalog(names, aliases, np.concatenate(coords))
+
+    @classmethod
+    def fetch(cls, directory: str = FETCHED, url: str = OPENNGC_URL) -> "Catalog":
+        """Download OpenNGC, add its objects to the bundled ones and save the result in ``directory``."""
+        with urlopen(url, timeout=60) as response, tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as f:
+            f.write(response.read())
+        try:
+            merged = cls.from_csv().merge(cls.from_openngc(f.name))
+        finally:
+            os.remove(f.name)
+
+        merged.save(directory)
+        return merged
+
+    @classmethod
+    def open(cls, directory: str):
+        names, aliases, _ = cls._read_names(os.path.join(directory, "names.csv"))
+        return cls(names, aliases, np.load(os.path.join(directory, "coords.npy"), mmap_mode="r"))
+
+    @classmethod
+    def load(cls):
+        """``ART_CATALOG``, else a fetched catalog, else the bundled one."""
+        directory = os.environ.get("ART_CATALOG") or (FETCHED if os.path.isdir(FETCHED) else None)
+        if directory:
+            return cls.open(directory)
+
+        return cls.from_csv()
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "coords.npy"), np.asarray(self.coords, dtype=np.float64))
+        aliases = [[] for _ in self.names]
+        for key, row in self.index.items():
+            aliases[row].append(key)
+
+        with open(os.path.join(directory, "names.csv"), "w", newline="") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(["name", "aliases"])
+            for name, others in zip(self.names, aliases):
+                writer.writerow([name, "|".join(others)])
+
+    def get(self, name: str):
+        """Return ``(ra, dec)`` of an exactly (case and space insensitive) matching name."""
+        row = self.index.get(normalize(name))
+        if row is None:
+            return None
+
+        ra, dec = self.coords[row]
+        return float(ra), float(dec)
+
+    def prefix(self, text: str, limit: int = 10) -> list:
+        key = normalize(text)
+        found = []
+        for each in self.keys[bisect_left(self.keys, key):]:
+            if not each.startswith(key) or len(found) >= limit:
+                break
+            name = self.names[self.index[each]]
+            if name not in found:
+                found.append(name)
+
+        return found
+
+    def fuzzy(self, text: str, limit: int = 5, cutoff: float = 0.75) -> list:
+        key = normalize(text)
+        candidates = [each for length in range(len(key) - FUZZY_LENGTH, len(key) + FUZZY_LENGTH + 1)
+                      for each in self._similar.get((key[:1], length), ())]
+        found = []
+        for each in get_close_matches(key, candidates, n=limit * 2, cutoff=cutoff):
+            name = self.names[self.index[each]]
+            if name not in found:
+                found.append(name)
+
+        return found[:limit]
+
+    def search(self, text: str, limit: int = 5) -> list:
+        """Names matching ``text`` exactly, by prefix or, failing both, approximately."""
+        row = self.index.get(normalize(text))
+        if row is not None:
+            return [self.names[row]]
+
+        return self.prefix(text, limit) or self.fuzzy(text, limit)
+
+
+catalog = Catalog.load()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["build"] and len(sys.argv) == 4:
+        Catalog.from_csv(sys.argv[2]).save(sys.argv[3])
+    elif sys.argv[1:2] == ["fetch"] and len(sys.argv) <= 3:
+        fetched = Catalog.fetch(*sys.argv[2:])
+        print(f"{len(fetched)} objects")
+    else:
+        sys.exit("usage: python -m art.catalog build SOURCE.csv DIRECTORY | fetch [DIRECTORY]")
@@ -0,0 +1,40 @@
+import io
+
+import matplotlib.dates as mdates
+import numpy as np
+from matplotlib import font_manager
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from .metrics import timed
+
+# Build (or load) the font cache once per process instead of on the first render.
+font_manager.findfont(font_manager.FontProperties())
+
+
+@timed("chart.visibility")
+def visibility(times, altitudes, labels: list, title: str = "MYRaf Object Visibility") -> bytes:
+    """Render altitude curves as a PNG.
+
+    ``altitudes`` has one column per label. Uses its own ``Figure`` on an Agg
+    canvas, so no pyplot state is shared and nothing outlives the call.
+    """
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    axes = figure.subplots()
+
+    axes.set_title(title)
+    altitudes = np.asarray(altitudes).reshape(len(times), -1)
+    for i, label in enumerate(labels):
+        axes.plot(times, altitudes[:, i], label=label)
+    axes.legend()
+    axes.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M"))
+    axes.tick_params(axis="x", labelrotation=45)
+    axes.set_xlabel("Time (UTC)")
+    axes.set_ylabel("Altitude (°)")
+    figure.tight_layout()
+
+    buf = io.BytesIO()
+    figure.savefig(buf, format="png")
+    figure.clear()
+    return buf.getvalue()
@@ -0,0 +1,65 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from time import monotonic
+
+
+class Entry:
+    __slots__ = ("png", "file_id", "expires")
+
+    def __init__(self, png: bytes, expires: float) -> None:
+        self.png = png
+        self.file_id = None
+        self.expires = expires
+
+
+class ChartCache:
+    """Content-addressed cache of rendered charts and the Telegram ``file_id`` of their first upload.
+
+    Entries expire after ``ttl`` seconds and the least recently used ones are
+    dropped once the PNGs exceed ``size`` bytes. Defaults are read from
+    ``ART_CHART_TTL`` and ``ART_CHART_CACHE_BYTES``.
+    """
+
+    def __init__(self, size: int = None, ttl: float = None) -> None:
+        self.size = size or int(os.environ.get("ART_CHART_CACHE_BYTES", 64 * 1024 * 1024))
+        self.ttl = ttl or float(os.environ.get("ART_CHART_TTL", 24 * 3600))
+        self.stats = {"hits": 0, "file_id_hits": 0, "misses": 0}
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    @staticmethod
+    def key(date: str, site: tuple, targets: list, **options) -> str:
+        """Key of a chart for a UTC ``date``, a quantized ``site`` and ``(label, ra, dec)`` targets."""
+        targets = sorted([label, round(ra, 6), round(dec, 6)] for label, ra, dec in targets)
+        content = json.dumps([date, list(site), targets, options], sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.png)
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None or entry.expires < monotonic():
+            if entry is not None:
+                self._drop(key)
+            self.stats["misses"] += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.stats["file_id_hits" if entry.file_id else "hits"] += 1
+        return entry
+
+    def put(self, key: str, png: bytes) -> Entry:
+        if key in self._entries:
+            self._drop(key)
+
+        entry = Entry(png, monotonic() + self.ttl)
+        self._entries[key] = entry
+        self._bytes += len(png)
+        while self._bytes > self.size and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)))
+
+        return entry
@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from time import perf_counter
+from typing import Any, NamedTuple, Optional
+
+from astropy.coordinates.name_resolve import NameResolveError
+
+from . import warmup
+from .iers import snapshot
+from .metrics import registry
+from .profiling import profiler
+from .obj import Object, ObjectCollection
+from .tm import Time
+
+logger = logging.getLogger(__name__)
+
+
+class Job(NamedTuple):
+    operation: str
+    kwargs: dict
+    timeout: Optional[float] = None
+
+
+class Result(NamedTuple):
+    value: Any = None
+    error: Optional[BaseException] = None
+    elapsed: float = 0.0
+    # Metrics recorded by a worker process while running the job
+    samples: Optional[dict] = None
+
+
+def from_name(name: str):
+    sky = Object.from_name(name)
+    return sky.ra, sky.dec
+
+
+def from_names(names: list):
+    """``(ra, dec)`` of every name, None for names that cannot be resolved."""
+    coords = []
+    for name in names:
+        try:
+            coords.append(from_name(name))
+        except NameResolveError:
+            coords.append(None)
+
+    return coords
+
+
+def eq2hor(ra: float, dec: float, time: str, longitude: float, latitude: float, altitude: float,
+           precision: str = "full"):
+    return Object(ra, dec).eq2hor(Time(time), longitude, latitude, altitude, precision)
+
+
+def eq2hor_batch(ras: list, decs: list, time: str, longitude: float, latitude: float, altitude: float,
+                 precision: str = "full"):
+    altaz = ObjectCollection(ras, decs).eq2hor(Time(time), longitude, latitude, altitude, precision)
+    return {
+        "alt": altaz["alt"][0, 0].tolist(),
+        "az": altaz["az"][0, 0].tolist()
+    }
+
+
+def visibility(ra: float, dec: float, time: str, longitude: float, latitude: float, altitude: float,
+               precision: str = "full"):
+    return Object(ra, dec).visibility(Time(time), longitude, latitude, altitude, precision)
+
+
+def chart(targets: list, time: str, longitude: float, latitude: float, altitude: float, precision: str = "full"):
+    """Render the visibility chart of ``targets``, a list of ``(label, ra, dec)``, as PNG bytes."""
+    # matplotlib is only needed by the processes that render charts
+    from .chart import visibility as visibility_chart
+
+    labels, ras, decs = zip(*targets)
+    times, altitudes = ObjectCollection(ras, decs).visibility(Time(time), longitude, latitude, altitude, precision)
+    return visibility_chart(times, altitudes, list(labels))
+
+
+def rise_set(ra: float, dec: float, time: str, longitude: float, latitude: float, altitude: float):
+    return Object(ra, dec).rise_set(Time(time), longitude, latitude, altitude)
+
+
+def rise_set_batch(ras: list, decs: list, time: str, longitude: float, latitude: float, altitude: float,
+                   precision: str = "full"):
+    return ObjectCollection(ras, decs).rise_set(Time(time), longitude, latitude, altitude, precision)
+
+
+def sidereal(time: str, longitude: float):
+    return Time(time).sidereal(longitude)
+
+
+def twilight(time: str, longitude: float, latitude: float, altitude: float, precision: str = "full"):
+    return Time(time).twilight(longitude, latitude, altitude, precision)
+
+
+def moon(time: str, longitude: float, latitude: float, altitude: float, precision: str = "full"):
+    return Time(time).moon(longitude, latitude, altitude, precision)
+
+
+TASKS = {
+    "from_name": from_name,
+    "from_names": from_names,
+    "eq2hor": eq2hor,
+    "eq2hor_batch": eq2hor_batch,
+    "visibility": visibility,
+    "chart": chart,
+    "rise_set": rise_set,
+    "rise_set_batch": rise_set_batch,
+    "sidereal": sidereal,
+    "twilight": twilight,
+    "moon": moon,
+    "warmup": warmup.run,
+}
+
+
+def initialize(warm: bool) -> None:
+    """Runs in every worker process: follow IERS snapshot updates and optionally warm up."""
+    # Metrics recorded here are sent back with each result instead of being served
+    registry.worker = True
+    registry.reset()
+    snapshot.watch()
+    if warm:
+        warmup.run()
+
+
+def execute(job: Job) -> Result:
+    start = perf_counter()
+    value, error = None, None
+    try:
+        value = profiler.run(job.operation, TASKS[job.operation], job.kwargs)
+    except Exception as e:
+        error = e
+
+    elapsed = perf_counter() - start
+    samples = registry.drain() if registry.worker and registry.enabled else None
+    return Result(value, error, elapsed, samples)
+
+
+class Executor:
+    """Runs `art` computations in a worker pool so the event loop stays responsive.
+
+    ``kind`` is ``"process"`` (default) or ``"thread"``. A process pool that
+    breaks, e.g. because a worker was killed, is started again; the jobs it
+    lost raise ``BrokenProcessPool``, since the one that killed the worker
+    would likely kill the next. After ``restarts`` breaks without a job
+    finishing in between, or when it cannot be started, a thread pool is used
+    instead.
+    Worker processes are set up by ``initialize``, with ``warm`` they run
+    ``warmup.run``. Defaults are read from ``ART_EXECUTOR``, ``ART_WORKERS``,
+    ``ART_JOB_TIMEOUT``, ``ART_WORKER_RESTARTS`` and ``ART_WARMUP``.
+
+    A job that times out raises ``asyncio.TimeoutError`` in the caller; the
+    worker is not interrupted and finishes in the background. ``pending``
+    counts the submitted jobs that have not finished yet.
+    """
+
+    def __init__(self, workers: int = None, kind: str = None, timeout: float = None, warm: bool = None,
+                 restarts: int = None) -> None:
+        self.workers = workers or int(os.environ.get("ART_WORKERS", os.cpu_count() or 1))
+        self.kind = kind or os.environ.get("ART_EXECUTOR", "process")
+        self.timeout = timeout or float(os.environ.get("ART_JOB_TIMEOUT", 60))
+        self.warm = warm if warm is not None else warmup.enabled()
+        self.restarts = restarts if restarts is not None else int(os.environ.get("ART_WORKER_RESTARTS", 3))
+        self.pending = 0
+        # Breaks of the process pool since a job last finished
+        self.broken = 0
+        self._pool = None
+
+    def _create_pool(self):
+        if self.kind == "process":
+            try:
+                return ProcessPoolExecutor(max_workers=self.workers, initializer=initialize, initargs=(self.warm,))
+            except (OSError, NotImplementedError, ImportError) as e:
+                logger.warning("Cannot start process pool (%s), falling back to threads", e)
+                self.kind = "thread"
+
+        return ThreadPoolExecutor(max_workers=self.workers)
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = self._create_pool()
+
+        return self._pool
+
+    def _replace(self, pool) -> None:
+        # Every job that was running on the broken pool gets here; only the first one replaces it
+        if self._pool is not pool:
+            return
+
+        pool.shutdown(wait=False)
+        self._pool = None
+        self.broken += 1
+        if self.broken > self.restarts:
+            logger.warning("Process pool broke %d times in a row, falling back to threads", self.broken)
+            self.kind = "thread"
+        else:
+            logger.warning("Process pool is broken, starting it again (%d/%d)", self.broken, self.restarts)
+
+    async def run(self, job: Job) -> Any:
+        loop = asyncio.get_running_loop()
+        start = perf_counter()
+        pool = self.pool
+        try:
+            future = loop.run_in_executor(pool, execute, job)
+            result = await asyncio.wait_for(future, job.timeout or self.timeout)
+        except BrokenProcessPool:
+            self._replace(pool)
+            raise
+
+        self.broken = 0
+        if result.samples is not None:
+            registry.merge(result.samples)
+        registry.observe("art_job_seconds", result.elapsed, operation=job.operation)
+        registry.observe("art_job_wait_seconds", perf_counter() - start - result.elapsed, operation=job.operation)
+        if result.error is not None:
+            raise result.error
+
+        return result.value
+
+    async def submit(self, operation: str, timeout: float = None, **kwargs) -> Any:
+        self.pending += 1
+        try:
+            return await self.run(Job(operation, kwargs, timeout))
+        finally:
+            self.pending -= 1
+
+    async def warmup(self) -> None:
+        """Start the workers and warm them up before the first request. Does nothing unless ``warm``."""
+        if not self.warm:
+            return
+
+        # Submitting one job per worker makes the process pool start all of them
+        count = self.workers if self.kind == "process" else 1
+        start = perf_counter()
+        results = await asyncio.gather(*[self.submit("warmup") for _ in range(count)], return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                logger.warning("Warm-up failed: %r", result)
+        logger.info("Warmed up %d %s worker(s) in %.2f s", count, self.kind, perf_counter() - start)
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
@@ -0,0 +1,112 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from astropy.coordinates import get_body
+from astropy.time import Time as aTime
+
+from . import fast, riseset
+
+EARTH_RADIUS = 6378.137
+TWILIGHT = -18.0
+
+SUN_RA, SUN_DEC, MOON_RA, MOON_DEC, MOON_DISTANCE, ILLUMINATION = range(6)
+
+
+class Ephemeris:
+    """Geocentric Sun and Moon positions and Moon illumination on a regular grid.
+
+    Rows are ``step`` days apart starting at ``start`` (UTC Julian date).
+    Right ascensions are stored unwrapped in degrees so they interpolate
+    linearly, the Moon's distance in km.
+    """
+
+    def __init__(self, start: float, days: float, step: float = 10 / 1440) -> None:
+        self.jd = start + np.arange(0, days + step, step)
+        times = aTime(self.jd, format="jd", scale="utc")
+        sun = get_body("sun", times)
+        moon = get_body("moon", times)
+
+        # Same phase angle as astroplan's moon_illumination
+        elongation = sun.separation(moon).radian
+        sun_distance = sun.distance.km
+        moon_distance = moon.distance.km
+        phase_angle = np.arctan2(sun_distance * np.sin(elongation),
+                                 moon_distance - sun_distance * np.cos(elongation))
+
+        self.table = np.column_stack([
+            np.unwrap(sun.ra.degree, period=360), sun.dec.degree,
+            np.unwrap(moon.ra.degree, period=360), moon.dec.degree,
+            moon_distance, (1 + np.cos(phase_angle)) / 2
+        ])
+
+    def interpolate(self, jd, column: int):
+        return np.interp(jd, self.jd, self.table[:, column])
+
+    def altitude(self, body: str, jd, longitude: float, latitude: float):
+        """Topocentric altitude of ``"sun"`` or ``"moon"`` (centre, no refraction) in degrees."""
+        if body == "sun":
+            ra, dec = self.interpolate(jd, SUN_RA), self.interpolate(jd, SUN_DEC)
+        else:
+            ra, dec = self.interpolate(jd, MOON_RA), self.interpolate(jd, MOON_DEC)
+
+        alt, _ = fast.altaz(np.mod(ra, 360) / 15, dec, jd, longitude, latitude)
+        if body == "moon":
+            parallax = np.arcsin(EARTH_RADIUS / self.interpolate(jd, MOON_DISTANCE) * np.cos(np.radians(alt)))
+            alt = alt - np.degrees(parallax)
+
+        return alt
+
+    def events(self, body: str, jd: float, level: float, longitude: float, latitude: float):
+        """Rising and setting crossings of ``level`` nearest to ``jd`` (NaN when there is none)."""
+        grid = self.jd[(self.jd >= jd - riseset.WINDOW) & (self.jd <= jd + riseset.WINDOW)]
+        values = self.altitude(body, grid, longitude, latitude)[:, None]
+        rise, set_ = riseset.crossings(jd, grid, values,
+                                       lambda t, n: self.altitude(body, t, longitude, latitude), level)
+        return rise[0], set_[0]
+
+    def twilight(self, jd: float, longitude: float, latitude: float) -> dict:
+        morning, evening = self.events("sun", jd, TWILIGHT, longitude, latitude)
+        return {
+            "morning": morning,
+            "evening": evening
+        }
+
+    def moon(self, jd: float, longitude: float, latitude: float) -> dict:
+        rise, set_ = self.events("moon", jd, 0.0, longitude, latitude)
+        return {
+            "rise": rise,
+            "set": set_,
+            "phase": float(self.interpolate(jd, ILLUMINATION))
+        }
+
+
+class Ephemerides:
+    """LRU of ``Ephemeris`` tables, each covering ``days`` UTC days plus a day on either side.
+
+    Defaults are read from ``ART_EPHEMERIS_DAYS`` and ``ART_EPHEMERIS_CACHE``.
+    """
+
+    def __init__(self, days: int = None, size: int = None) -> None:
+        self.days = days or int(os.environ.get("ART_EPHEMERIS_DAYS", 1))
+        self.size = size or int(os.environ.get("ART_EPHEMERIS_CACHE", 8))
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, jd: float) -> Ephemeris:
+        block = int(np.floor((jd - 0.5) / self.days))
+        with self._lock:
+            table = self._tables.get(block)
+            if table is not None:
+                self._tables.move_to_end(block)
+                return table
+
+            table = self._tables[block] = Ephemeris(block * self.days + 0.5 - 1, self.days + 2)
+            while len(self._tables) > self.size:
+                self._tables.popitem(last=False)
+
+        return table
+
+
+ephemerides = Ephemerides()
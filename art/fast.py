@@ -0,0 +1,59 @@
+"""Closed-form alt/az in plain NumPy.
+
+Coordinates are precessed from J2000 to the mean equinox of date, then
+converted with the mean sidereal time. Nutation, aberration, polar motion
+and UT1-UTC are ignored, which keeps the result within about an arcminute
+of astropy's ``AltAz`` transform (no refraction) at a fraction of the cost.
+
+All functions broadcast over their array arguments. Right ascensions are in
+hours, everything else in degrees, times are UTC Julian dates.
+"""
+import numpy as np
+
+J2000 = 2451545.0
+
+
+def gmst(jd):
+    """Greenwich mean sidereal time in degrees (IAU 1982)."""
+    d = np.asarray(jd, dtype=float) - J2000
+    t = d / 36525
+    return np.mod(280.46061837 + 360.98564736629 * d + 0.000387933 * t ** 2 - t ** 3 / 38710000, 360)
+
+
+def lst(jd, longitude):
+    """Local mean sidereal time in degrees."""
+    return np.mod(gmst(jd) + longitude, 360)
+
+
+def precess(ra, dec, jd):
+    """Precess J2000 ``ra`` (hours), ``dec`` (degrees) to the mean equinox of ``jd``. Returns degrees."""
+    t = (np.asarray(jd, dtype=float) - J2000) / 36525
+    zeta = np.radians((2306.2181 * t + 0.30188 * t ** 2 + 0.017998 * t ** 3) / 3600)
+    z = np.radians((2306.2181 * t + 1.09468 * t ** 2 + 0.018203 * t ** 3) / 3600)
+    theta = np.radians((2004.3109 * t - 0.42665 * t ** 2 - 0.041833 * t ** 3) / 3600)
+
+    ra = np.radians(np.asarray(ra, dtype=float) * 15) + zeta
+    dec = np.radians(np.asarray(dec, dtype=float))
+    a = np.cos(dec) * np.sin(ra)
+    b = np.cos(theta) * np.cos(dec) * np.cos(ra) - np.sin(theta) * np.sin(dec)
+    c = np.sin(theta) * np.cos(dec) * np.cos(ra) + np.cos(theta) * np.sin(dec)
+
+    return np.mod(np.degrees(np.arctan2(a, b) + z), 360), np.degrees(np.arcsin(np.clip(c, -1, 1)))
+
+
+def hour_angle(ra, dec, jd, longitude):
+    """Hour angle in degrees (-180, 180] and declination of date."""
+    ra_date, dec_date = precess(ra, dec, jd)
+    return np.mod(lst(jd, longitude) - ra_date + 180, 360) - 180, dec_date
+
+
+def altaz(ra, dec, jd, longitude, latitude):
+    """Altitude and azimuth (north through east) in degrees."""
+    ha, dec_date = hour_angle(ra, dec, jd, longitude)
+    h = np.radians(ha)
+    d = np.radians(dec_date)
+    phi = np.radians(np.asarray(latitude, dtype=float))
+
+    alt = np.arcsin(np.clip(np.sin(phi) * np.sin(d) + np.cos(phi) * np.cos(d) * np.cos(h), -1, 1))
+    az = np.arctan2(-np.cos(d) * np.sin(h), np.sin(d) * np.cos(phi) - np.cos(d) * np.sin(phi) * np.cos(h))
+    return np.degrees(alt), np.mod(np.degrees(az), 360)
@@ -0,0 +1,185 @@
+"""Local IERS Earth orientation and leap-second snapshot.
+
+astropy is pinned to the tables in ``ART_IERS_DIR`` with automatic downloads
+disabled, so no time conversion ever waits for the network. Without a
+snapshot astropy's bundled IERS-B table and leap-second file are used.
+
+    python -m art.iers status
+    python -m art.iers refresh
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import erfa
+from astropy.time import Time as aTime
+from astropy.utils import iers
+from astropy.utils.data import download_file
+
+logger = logging.getLogger(__name__)
+
+IERS_FILE = "finals2000A.all"
+LEAP_FILE = "Leap_Second.dat"
+
+
+class Snapshot:
+    """IERS-A and leap-second files in ``directory`` and the astropy state that uses them.
+
+    A snapshot older than ``max_age`` days is stale. ``watch`` checks it every
+    ``interval`` seconds in a background thread. Defaults are read from
+    ``ART_IERS_DIR``, ``ART_IERS_MAX_AGE`` and ``ART_IERS_CHECK``.
+    """
+
+    def __init__(self, directory: str = None, max_age: float = None, interval: float = None) -> None:
+        self.directory = directory or os.environ.get("ART_IERS_DIR", os.path.join(os.path.dirname(__file__),
+                                                                                   "data", "iers"))
+        self.max_age = timedelta(days=max_age or float(os.environ.get("ART_IERS_MAX_AGE", 7)))
+        self.interval = interval or float(os.environ.get("ART_IERS_CHECK", 3600))
+        self.installed = None
+        self._lock = threading.Lock()
+        self._watcher = None
+        if hasattr(os, "register_at_fork"):
+            # A forked worker has no watcher thread and may inherit the lock held
+            os.register_at_fork(after_in_child=self._forked)
+
+    def _forked(self) -> None:
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def fetched(self):
+        """Modification time of the snapshot, None when there is none."""
+        try:
+            return datetime.utcfromtimestamp(os.path.getmtime(self.path(IERS_FILE)))
+        except OSError:
+            return None
+
+    def install(self) -> None:
+        """Load the snapshot (or the bundled tables) into astropy and ERFA and turn off downloads."""
+        with self._lock:
+            iers.conf.auto_download = False
+            # Any local leap-second table is good enough, so astropy never looks for a newer one
+            iers.conf.auto_max_age = None
+            # Times past the tables use the last values; ``status`` tells when that happens
+            iers.conf.iers_degraded_accuracy = "ignore"
+
+            fetched = self.fetched()
+            if fetched is not None:
+                iers.earth_orientation_table.set(iers.IERS_A.open(self.path(IERS_FILE)))
+            else:
+                iers.earth_orientation_table.set(iers.IERS_B.open())
+
+            leap = self.path(LEAP_FILE)
+            erfa.leap_seconds.update(iers.LeapSeconds.open(leap if os.path.exists(leap)
+                                                           else iers.IERS_LEAP_SECOND_FILE))
+            self.installed = fetched
+
+    def status(self) -> dict:
+        table = iers.earth_orientation_table.get()
+        measured = table["MJD"]
+        if "UT1Flag" in table.colnames:
+            measured = measured[table["UT1Flag"] == "I"]
+
+        fetched = self.fetched()
+        valid_until = min(aTime(table["MJD"][-1], format="mjd").datetime, erfa.leap_seconds.expires)
+        now = datetime.utcnow()
+        return {
+            "directory": self.directory,
+            "source": "snapshot" if self.installed is not None else "bundled",
+            "fetched": fetched.isoformat(timespec="seconds") if fetched else None,
+            "age_days": round((now - fetched).total_seconds() / 86400, 2) if fetched else None,
+            "measured_until": aTime(measured[-1], format="mjd").datetime.date().isoformat(),
+            "valid_until": valid_until.date().isoformat(),
+            "leap_seconds_expire": erfa.leap_seconds.expires.date().isoformat(),
+            "stale": fetched is None or now - fetched > self.max_age or now > valid_until,
+        }
+
+    def stale(self) -> bool:
+        fetched = self.fetched()
+        return fetched is None or datetime.utcnow() - fetched > self.max_age
+
+    def refresh(self) -> bool:
+        """Download a new snapshot and install it. On failure the current one is kept and False returned."""
+        os.makedirs(self.directory, exist_ok=True)
+        sources = [
+            (IERS_FILE, [iers.conf.iers_auto_url, iers.conf.iers_auto_url_mirror], iers.IERS_A.open),
+            (LEAP_FILE, [iers.conf.iers_leap_second_auto_url, iers.conf.ietf_leap_second_auto_url],
+             iers.LeapSeconds.open),
+        ]
+        downloads = []
+        for name, urls, reader in sources:
+            for url in urls:
+                try:
+                    downloaded = download_file(url, cache=False, timeout=iers.conf.remote_timeout)
+                    reader(downloaded)
+                except Exception as e:
+                    logger.warning("Cannot download %s from %s: %s", name, url, e)
+                    continue
+
+                downloads.append((downloaded, name))
+                break
+            else:
+                return False
+
+        # Leap seconds first: a new IERS file is what marks the snapshot as changed
+        for downloaded, name in reversed(downloads):
+            self._move(downloaded, self.path(name))
+        self.install()
+        logger.info("Installed IERS snapshot valid until %s", self.status()["valid_until"])
+        return True
+
+    @staticmethod
+    def _move(source: str, destination: str) -> None:
+        # Downloads land in the system temporary directory, possibly on another file system
+        temporary = destination + ".tmp"
+        with open(source, "rb") as src, open(temporary, "wb") as dst:
+            dst.write(src.read())
+        os.replace(temporary, destination)
+        os.remove(source)
+
+    def _check(self, refresh: bool) -> None:
+        if refresh and self.stale():
+            self.refresh()
+        elif self.fetched() != self.installed:
+            self.install()
+
+    def watch(self, refresh: bool = False) -> None:
+        """Check the snapshot every ``interval`` seconds in a daemon thread.
+
+        Changed files are installed; with ``refresh`` a stale snapshot is
+        downloaded first. Only one process should refresh, the others pick the
+        new files up.
+        """
+        if self._watcher is not None:
+            return
+
+        def run():
+            while True:
+                try:
+                    self._check(refresh)
+                except Exception:
+                    logger.exception("IERS snapshot check failed")
+                time.sleep(self.interval)
+
+        self._watcher = threading.Thread(target=run, name="iers", daemon=True)
+        self._watcher.start()
+
+
+snapshot = Snapshot()
+snapshot.install()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in ("status", "refresh"):
+        sys.exit("usage: python -m art.iers status | refresh")
+
+    if sys.argv[1] == "refresh" and not snapshot.refresh():
+        sys.exit("refresh failed, the current snapshot is kept")
+
+    print(json.dumps(snapshot.status(), indent=2))
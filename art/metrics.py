@@ -0,0 +1,264 @@
+"""Latency histograms and counters, served in the Prometheus text format.
+
+Metrics are off unless ``ART_METRICS_PORT`` is set; ``serve`` then exposes
+them on ``http://ART_METRICS_HOST:ART_METRICS_PORT/metrics``. While they are
+off ``timed`` and ``handler`` return the decorated function unchanged and
+``timer``, ``count`` and ``observe`` return at once.
+
+Worker processes of ``art.compute`` record into their own registry and send
+what they recorded back with each job result, see ``drain`` and ``merge``.
+"""
+import asyncio
+import functools
+import os
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import accumulate
+from time import perf_counter
+
+# Upper bounds in seconds of the histogram buckets, +Inf is added
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRICS = {
+    "art_handler_seconds": ("histogram", "Time spent in a bot handler."),
+    "art_handler_errors_total": ("counter", "Exceptions raised by a bot handler."),
+    "art_stage_seconds": ("histogram", "Time spent in a stage of answering a request."),
+    "art_call_seconds": ("histogram", "Time spent in an art method."),
+    "art_job_seconds": ("histogram", "Time a job ran in a worker."),
+    "art_job_wait_seconds": ("histogram", "Time a job waited for a worker and for its result to come back."),
+    "art_telegram_seconds": ("histogram", "Time of a Bot API call."),
+    "art_requests_total": ("counter", "Answered requests by operation."),
+    "art_cache_total": ("counter", "Cache lookups by cache and result."),
+    "art_request_log_total": ("counter", "Rows of the request log by outcome."),
+    "art_scheduler_total": ("counter", "Jobs the scheduler accepted or rejected, by reason."),
+    "art_queue_depth": ("gauge", "Items waiting in a queue."),
+}
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+def _bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else format(bound, "g")
+
+
+class Registry:
+    """Counters, histograms, gauges and the ``stats`` dicts of caches.
+
+    Histograms share ``BUCKETS``. ``track`` exposes a ``stats`` dict as
+    counters and ``gauge`` a function read at every scrape. Metrics are
+    recorded only when ``enabled``, by default when ``ART_METRICS_PORT`` is set.
+    """
+
+    def __init__(self, enabled: bool = None) -> None:
+        self.enabled = enabled if enabled is not None else bool(os.environ.get("ART_METRICS_PORT"))
+        self.worker = False
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._tracked = {}
+        self._gauges = {}
+        # pid: the tracked statistics last sent by that worker process
+        self._remote = {}
+        # Tracked statistics a worker process inherited from its parent, see reset
+        self._baseline = {}
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._counters[name, tuple(labels.items())] += value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        if not self.enabled:
+            return
+
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # A count per bucket and the sum
+                histogram = self._histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+            histogram[bisect_left(BUCKETS, seconds)] += 1
+            histogram[-1] += seconds
+
+    def track(self, name: str, stats: dict, **labels) -> None:
+        """Expose every key of ``stats`` as the counter ``name`` with an ``event`` label."""
+        self._tracked[name, tuple(labels.items())] = stats
+
+    def gauge(self, name: str, function, **labels) -> None:
+        self._gauges[name, tuple(labels.items())] = function
+
+    def _stats(self) -> dict:
+        return {(name, labels + (("event", event),)): value
+                for (name, labels), stats in self._tracked.items() for event, value in list(stats.items())}
+
+    def reset(self) -> None:
+        """Forget what was recorded. In a worker, tracked statistics count from here on."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._remote.clear()
+            # A forked worker starts with copies of the parent's stats dicts, which the parent already reports
+            self._baseline = self._stats() if self.worker else {}
+
+    def drain(self) -> dict:
+        """Take what was recorded since the last call, with the current tracked statistics, for ``merge``."""
+        with self._lock:
+            counters, histograms = dict(self._counters), self._histograms
+            self._counters, self._histograms = defaultdict(float), {}
+
+        stats = {key: value - self._baseline.get(key, 0) for key, value in self._stats().items()}
+        return {"pid": os.getpid(), "counters": counters, "histograms": histograms,
+                "stats": {key: value for key, value in stats.items() if value}}
+
+    def merge(self, samples: dict) -> None:
+        with self._lock:
+            for key, value in samples["counters"].items():
+                self._counters[key] += value
+            for key, histogram in samples["histograms"].items():
+                mine = self._histograms.setdefault(key, [0] * (len(BUCKETS) + 1) + [0.0])
+                for i, value in enumerate(histogram):
+                    mine[i] += value
+            self._remote[samples["pid"]] = samples["stats"]
+
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(histogram) for key, histogram in self._histograms.items()}
+            remote = list(self._remote.values())
+
+        for stats in remote + [self._stats()]:
+            for key, value in stats.items():
+                counters[key] = counters.get(key, 0) + value
+
+        samples = defaultdict(list)
+        for (name, labels), value in counters.items():
+            samples[name].append(f"{name}{_labels(labels)} {value:g}")
+        for (name, labels), function in list(self._gauges.items()):
+            samples[name].append(f"{name}{_labels(labels)} {function():g}")
+        for (name, labels), histogram in histograms.items():
+            cumulative = list(accumulate(histogram[:-1]))
+            for bound, count in zip(BUCKETS + (float("inf"),), cumulative):
+                samples[name].append(f"{name}_bucket{_labels(labels + (('le', _bound(bound)),))} {count}")
+            samples[name].append(f"{name}_sum{_labels(labels)} {histogram[-1]:g}")
+            samples[name].append(f"{name}_count{_labels(labels)} {cumulative[-1]}")
+
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            if name in samples:
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}", *sorted(samples[name])]
+
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _wrap(function, name: str, errors: str = None, **labels):
+    if asyncio.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            except Exception:
+                if errors:
+                    registry.count(errors, **labels)
+                raise
+            finally:
+                registry.observe(name, perf_counter() - start, **labels)
+    else:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                if errors:
+                    registry.count(errors, **labels)
+                raise
+            finally:
+                registry.observe(name, perf_counter() - start, **labels)
+
+    return wrapper
+
+
+def timed(call: str):
+    """Decorator timing every call into ``art_call_seconds{call=...}``."""
+    def decorate(function):
+        if not registry.enabled:
+            return function
+
+        return _wrap(function, "art_call_seconds", call=call)
+
+    return decorate
+
+
+def handler(callback):
+    """Decorator timing a bot handler into ``art_handler_seconds`` and counting its exceptions."""
+    if not registry.enabled:
+        return callback
+
+    return _wrap(callback, "art_handler_seconds", "art_handler_errors_total", handler=callback.__name__)
+
+
+@contextmanager
+def timer(stage: str):
+    """Time the ``with`` block into ``art_stage_seconds{stage=...}``."""
+    if not registry.enabled:
+        yield
+        return
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe("art_stage_seconds", perf_counter() - start, stage=stage)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        content = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+_server = None
+
+
+def serve(port: int = None, host: str = None):
+    """Serve ``/metrics`` from a daemon thread and return the server, None while metrics are off.
+
+    Defaults are read from ``ART_METRICS_PORT`` and ``ART_METRICS_HOST``
+    (``127.0.0.1``).
+    """
+    global _server
+    if not registry.enabled or _server is not None:
+        return _server
+
+    port = port or int(os.environ["ART_METRICS_PORT"])
+    host = host or os.environ.get("ART_METRICS_HOST", "127.0.0.1")
+    _server = ThreadingHTTPServer((host, port), _Handler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    return _server
@@ -1,12 +1,25 @@
+import warnings
 from datetime import timedelta, datetime
 
-from astroplan import Observer
+import numpy as np
 from astropy.coordinates import SkyCoord, EarthLocation, AltAz
 from astropy import units
 from astropy.time import Time as aTime
+from . import fast, riseset
+from .catalog import catalog
+from .metrics import timed
+from .resolver import resolver
+from .site import sites
 from .tm import Time
 
 
+def night(dt: Time) -> aTime:
+    """Half-hourly times from noon of ``dt``'s UTC date to noon of the next day."""
+    # t = dt.dt.to_datetime()
+    t = datetime.combine(dt.dt.to_datetime(), datetime.min.time())
+    return aTime([t + timedelta(hours=d / 2 + 12) for d in range(48)])
+
+
 class Object:
     def __init__(self, ra: float = None, dec: float = None):
         self.ra = ra
@@ -15,35 +28,142 @@ class Object:
         self.sky = SkyCoord(ra=self.ra, dec=self.dec, unit=(units.hourangle, units.deg))
 
     @classmethod
+    @timed("Object.from_name")
     def from_name(cls, name: str):
-        coords = SkyCoord.from_name(name)
-        return cls(coords.ra.hour, coords.dec.degree)
+        coords = catalog.get(name)
+        if coords is None:
+            coords = resolver.resolve(name)
+
+        return cls(*coords)
+
+    @timed("Object.eq2hor")
+    def eq2hor(self, dt: Time, longitude: float, latitude: float, altitude: float, precision: str = "full"):
+        if precision == "fast":
+            alt, az = fast.altaz(self.ra, self.dec, dt.dt.jd, longitude, latitude)
+            return {
+                "alt": float(alt),
+                "az": float(az)
+            }
 
-    def eq2hor(self, dt: Time, longitude: float, latitude: float, altitude: float):
-        site = EarthLocation(longitude * units.deg, latitude * units.deg, altitude * units.m)
+        site = sites.get(longitude, latitude, altitude)
 
-        frame = AltAz(obstime=dt.dt, location=site)
-        altaz = self.sky.transform_to(frame)
+        altaz = self.sky.transform_to(site.altaz(dt.dt))
         return {
             "alt": altaz.alt.degree,
             "az": altaz.az.degree
         }
 
-    def visibility(self, dt: Time, longitude: float, latitude: float, altitude: float):
-        site = EarthLocation(longitude * units.deg, latitude * units.deg, altitude * units.m)
-        # t = dt.dt.to_datetime()
-        t = datetime.combine(dt.dt.to_datetime(), datetime.min.time())
-        one_day = aTime([t + timedelta(hours=d / 2 + 12) for d in range(48)])
-        frame = AltAz(obstime=one_day, location=site)
+    @timed("Object.visibility")
+    def visibility(self, dt: Time, longitude: float, latitude: float, altitude: float, precision: str = "full"):
+        one_day = night(dt)
+        if precision == "fast":
+            obj_alt, _ = fast.altaz(self.ra, self.dec, one_day.jd, longitude, latitude)
+            return one_day.to_datetime(), obj_alt.tolist()
 
-        obj_alt_az = self.sky.transform_to(frame)
+        site = sites.get(longitude, latitude, altitude)
+        obj_alt_az = self.sky.transform_to(site.altaz(one_day))
         obj_alt = obj_alt_az.alt.degree.tolist()
         return one_day.to_datetime(), obj_alt
 
+    @timed("Object.rise_set")
     def rise_set(self, dt: Time, longitude: float, latitude: float, altitude: float):
-        site = EarthLocation(longitude * units.deg, latitude * units.deg, altitude * units.m)
-        obs = Observer(site)
+        site = sites.get(longitude, latitude, altitude)
+        obs = site.observer
+        return {
+            "rise": obs.target_rise_time(dt.dt, self.sky).strftime("%H:%M:%S"),
+            "set": obs.target_set_time(dt.dt, self.sky).strftime("%H:%M:%S")
+        }
+
+
+class ObjectCollection:
+    """Many objects transformed together.
+
+    Results are arrays shaped ``(sites, times, objects)``; scalar times and
+    locations count as a single time and a single site.
+    """
+
+    def __init__(self, ra, dec):
+        self.ra = np.atleast_1d(np.asarray(ra, dtype=float))
+        self.dec = np.atleast_1d(np.asarray(dec, dtype=float))
+
+        self.sky = SkyCoord(ra=self.ra, dec=self.dec, unit=(units.hourangle, units.deg))
+
+    def __len__(self):
+        return len(self.ra)
+
+    @classmethod
+    def from_objects(cls, objects: list):
+        return cls([each.ra for each in objects], [each.dec for each in objects])
+
+    @classmethod
+    def from_names(cls, names: list):
+        return cls.from_objects([Object.from_name(name) for name in names])
+
+    @timed("ObjectCollection.eq2hor")
+    def eq2hor(self, dt: Time, longitude, latitude, altitude, precision: str = "full"):
+        if precision == "fast":
+            jd = np.atleast_1d(dt.dt.jd)
+            alt, az = fast.altaz(self.ra[None, None, :], self.dec[None, None, :], jd[None, :, None],
+                                 np.atleast_1d(longitude)[:, None, None], np.atleast_1d(latitude)[:, None, None])
+            return {
+                "alt": alt,
+                "az": az
+            }
+
+        site = EarthLocation(np.atleast_1d(longitude) * units.deg, np.atleast_1d(latitude) * units.deg,
+                             np.atleast_1d(altitude) * units.m)
+        obstime = dt.dt.reshape(-1) if dt.dt.shape else dt.dt.reshape(1)
+
+        frame = AltAz(obstime=obstime[None, :, None], location=site[:, None, None])
+        altaz = self.sky[None, None, :].transform_to(frame)
         return {
-            "rise": obs.target_set_time(dt.dt, self.sky).strftime("%H:%M:%S"),
-            "set": obs.target_rise_time(dt.dt, self.sky).strftime("%H:%M:%S")
+            "alt": altaz.alt.degree,
+            "az": altaz.az.degree
         }
+
+    @timed("ObjectCollection.visibility")
+    def visibility(self, dt: Time, longitude: float, latitude: float, altitude: float, precision: str = "full"):
+        """Altitudes over ``night(dt)`` as a ``(times, objects)`` array, with the times as datetimes."""
+        one_day = night(dt)
+        altaz = self.eq2hor(Time(one_day.isot), longitude, latitude, altitude, precision)
+        return one_day.to_datetime(), altaz["alt"][0]
+
+    def _rise_set_full(self, dt: Time, longitude: float, latitude: float, altitude: float) -> dict:
+        obs = sites.get(longitude, latitude, altitude).observer
+        with warnings.catch_warnings():
+            # astroplan warns about every target that never rises or sets
+            warnings.simplefilter("ignore")
+            events = {
+                key: np.ma.filled(np.ma.asarray(find(dt.dt, self.sky, which="nearest").jd, dtype=float), np.nan)
+                for key, find in (("rise", obs.target_rise_time), ("set", obs.target_set_time),
+                                  ("transit", obs.target_meridian_transit_time))
+            }
+            up = np.atleast_1d(obs.target_is_up(dt.dt, self.sky))
+
+        events["status"] = np.where(~np.isnan(events["rise"]) | ~np.isnan(events["set"]), "rises",
+                                    np.where(up, "circumpolar", "never")).tolist()
+        return events
+
+    @timed("ObjectCollection.rise_set")
+    def rise_set(self, dt: Time, longitude: float, latitude: float, altitude: float, precision: str = "full"):
+        """Rise, set and transit times nearest to ``dt`` for every object.
+
+        ``"full"`` asks astroplan; ``"fast"`` solves all objects in one
+        vectorized pass, see ``riseset.solve``. Times are ``None`` when
+        the event does not happen (see ``status``).
+        """
+        if precision == "fast":
+            events = riseset.solve(self.ra, self.dec, dt.dt.jd, longitude, latitude)
+        else:
+            events = self._rise_set_full(dt, longitude, latitude, altitude)
+
+        return [
+            {
+                **{
+                    key: None if np.isnan(events[key][i]) else riseset.to_datetime(events[key][i]).strftime("%H:%M:%S")
+                    for key in ("rise", "set", "transit")
+                },
+                "status": events["status"][i]
+            }
+            for i in range(len(self))
+        ]
@@ -0,0 +1,147 @@
+"""Opt-in cProfile capture of slow calculations.
+
+With ``ART_PROFILE_DIR`` set every job of ``art.compute`` runs under cProfile
+in its worker. The profiles of slow jobs and of a sample of the others are
+written next to a JSON file with the operation and inputs as the request log
+records them::
+
+    python -m art.profiling list
+    python -m art.profiling show PROFILE [--sort tottime] [--limit 40]
+"""
+import argparse
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import sys
+from datetime import datetime
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+# Jobs and the request log operation they answer
+OPERATIONS = {
+    "chart": "Visibility",
+    "eq2hor_batch": "E2H",
+    "rise_set_batch": "Object",
+    "moon": "Moon",
+    "twilight": "Twilight",
+    "sidereal": "Sidereal",
+}
+KEYS = {"latitude": "lat", "longitude": "lon", "ras": "ra", "decs": "dec"}
+
+
+def tag(operation: str, kwargs: dict):
+    """The operation and inputs of a job named like in the request log."""
+    inputs = {KEYS.get(key, key): value for key, value in kwargs.items()}
+    if "targets" in inputs:
+        inputs["labels"], inputs["ra"], inputs["dec"] = map(list, zip(*inputs.pop("targets")))
+
+    return OPERATIONS.get(operation, operation), inputs
+
+
+class Profiler:
+    """Profiles calls and keeps the slow ones and a sample of the others.
+
+    Off unless ``directory`` is set. A profile is written when the call took
+    ``threshold`` seconds or more and for a ``rate`` fraction of the other
+    calls; only the newest ``keep`` profiles are kept. Defaults are read from
+    ``ART_PROFILE_DIR``, ``ART_PROFILE_THRESHOLD``, ``ART_PROFILE_RATE`` and
+    ``ART_PROFILE_KEEP``.
+    """
+
+    def __init__(self, directory: str = None, threshold: float = None, rate: float = None,
+                 keep: int = None) -> None:
+        self.directory = directory or os.environ.get("ART_PROFILE_DIR")
+        self.threshold = threshold or float(os.environ.get("ART_PROFILE_THRESHOLD", 5))
+        self.rate = rate if rate is not None else float(os.environ.get("ART_PROFILE_RATE", 0.01))
+        self.keep = keep or int(os.environ.get("ART_PROFILE_KEEP", 200))
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def run(self, operation: str, function, kwargs: dict):
+        """``function(**kwargs)``, profiled while enabled."""
+        if not self.enabled:
+            return function(**kwargs)
+
+        profile = cProfile.Profile()
+        start = perf_counter()
+        try:
+            return profile.runcall(function, **kwargs)
+        finally:
+            elapsed = perf_counter() - start
+            slow = elapsed >= self.threshold
+            if slow or random.random() < self.rate:
+                try:
+                    self.save(profile, operation, kwargs, elapsed, slow)
+                except OSError:
+                    logger.exception("Cannot save the profile of %s", operation)
+
+    def save(self, profile: cProfile.Profile, operation: str, kwargs: dict, elapsed: float, slow: bool) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        name, inputs = tag(operation, kwargs)
+        created = datetime.utcnow()
+        path = os.path.join(self.directory, f"{created:%Y%m%dT%H%M%S.%f}-{name}-{elapsed * 1e3:.0f}ms-{os.getpid()}")
+
+        profile.dump_stats(path + ".prof")
+        with open(path + ".json", "w") as f:
+            json.dump({"operation": name, "job": operation, "inputs": inputs, "seconds": round(elapsed, 4),
+                       "slow": slow, "created_on": created.isoformat(), "pid": os.getpid()}, f, default=str)
+        self._rotate()
+
+        if slow:
+            logger.warning("%s took %.2f s, profiled in %s.prof", name, elapsed, path)
+        return path + ".prof"
+
+    def _rotate(self) -> None:
+        # Names start with the time, so they sort oldest first
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".prof"))
+        for name in names[:max(len(names) - self.keep, 0)]:
+            for extension in (".prof", ".json"):
+                try:
+                    os.remove(os.path.join(self.directory, name[:-len(".prof")] + extension))
+                except FileNotFoundError:
+                    # Another worker rotated it first
+                    pass
+
+    def profiles(self) -> list:
+        """The metadata of the kept profiles, newest first."""
+        if not self.enabled or not os.path.isdir(self.directory):
+            return []
+
+        found = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if name.endswith(".json"):
+                with open(os.path.join(self.directory, name)) as f:
+                    found.append({"profile": os.path.join(self.directory, name[:-len(".json")] + ".prof"),
+                                  **json.load(f)})
+        return found
+
+
+profiler = Profiler()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m art.profiling")
+    parser.add_argument("--directory", default=None, help="profile directory, default ART_PROFILE_DIR")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="kept profiles, newest first")
+    show = commands.add_parser("show", help="print the statistics of a profile")
+    show.add_argument("profile")
+    show.add_argument("--sort", default="cumulative")
+    show.add_argument("--limit", type=int, default=25)
+    args = parser.parse_args()
+
+    if args.command == "list":
+        listed = Profiler(args.directory) if args.directory else profiler
+        if not listed.enabled:
+            sys.exit("set ART_PROFILE_DIR or pass --directory")
+        for each in listed.profiles():
+            print(f"{each['created_on']}  {each['operation']:<10} {each['seconds']:8.3f} s  "
+                  f"{'slow ' if each['slow'] else ''}{os.path.basename(each['profile'])}  {json.dumps(each['inputs'])}")
+    else:
+        pstats.Stats(args.profile).strip_dirs().sort_stats(args.sort).print_stats(args.limit)
@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from astropy.coordinates import SkyCoord
+from astropy.coordinates.name_resolve import NameResolveError
+from peewee import Model, SqliteDatabase, CharField, DateTimeField, FloatField, PeeweeException
+
+from .catalog import normalize
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+db = SqliteDatabase(os.environ.get("ART_CACHE_DB", "requests.db"))
+
+
+class Resolved(Model):
+    name = CharField(primary_key=True)
+    ra = FloatField(null=True)
+    dec = FloatField(null=True)
+    created_on = DateTimeField(index=True)
+
+    class Meta:
+        database = db
+
+
+class Resolver:
+    """Two-tier (memory LRU + SQLite) cache in front of ``SkyCoord.from_name``.
+
+    Coordinates are cached for ``ttl`` seconds, names that fail to resolve for
+    ``negative_ttl`` seconds. The in-process tier holds at most ``size`` names,
+    the SQLite tier at most ``max_rows``. Cache errors never fail a lookup.
+    The memory tier may be shared by the threads of a thread pool executor.
+    The bot runs ``purge`` every ``purge_interval`` seconds
+    (``ART_NAME_PURGE_INTERVAL``).
+    """
+
+    def __init__(self, size: int = None, ttl: float = None, negative_ttl: float = None,
+                 max_rows: int = None, purge_interval: float = None) -> None:
+        self.size = size or int(os.environ.get("ART_NAME_CACHE_SIZE", 1024))
+        self.ttl = timedelta(seconds=ttl or float(os.environ.get("ART_NAME_TTL", 30 * 24 * 3600)))
+        self.negative_ttl = timedelta(
+            seconds=negative_ttl or float(os.environ.get("ART_NAME_NEGATIVE_TTL", 300)))
+        self.max_rows = max_rows or int(os.environ.get("ART_NAME_CACHE_ROWS", 100000))
+        self.purge_interval = purge_interval or float(os.environ.get("ART_NAME_PURGE_INTERVAL", 6 * 3600))
+        self.stats = {"hits": 0, "disk_hits": 0, "negative_hits": 0, "misses": 0}
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _expires(self, created_on: datetime, coords) -> datetime:
+        return created_on + (self.ttl if coords is not None else self.negative_ttl)
+
+    def _remember(self, key: str, coords, expires: datetime) -> None:
+        with self._lock:
+            self._memory[key] = (coords, expires)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.size:
+                self._memory.popitem(last=False)
+
+    def _from_memory(self, key: str):
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is None:
+                return None
+
+            if cached[1] < datetime.utcnow():
+                del self._memory[key]
+                return None
+
+            self._memory.move_to_end(key)
+            self.stats["hits"] += 1
+            return cached
+
+    def _create(self) -> None:
+        if not self._ready:
+            db.create_tables([Resolved], safe=True)
+            self._ready = True
+
+    def _from_disk(self, key: str):
+        try:
+            self._create()
+            row = Resolved.get_or_none(Resolved.name == key)
+        except PeeweeException as e:
+            logger.warning("Name cache unavailable: %s", e)
+            return None
+
+        if row is None:
+            return None
+
+        coords = (row.ra, row.dec) if row.ra is not None else None
+        expires = self._expires(row.created_on, coords)
+        if expires < datetime.utcnow():
+            return None
+
+        self.stats["disk_hits"] += 1
+        return coords, expires
+
+    def _store(self, key: str, coords, created_on: datetime) -> None:
+        ra, dec = coords if coords is not None else (None, None)
+        try:
+            with db.atomic():
+                Resolved.replace(name=key, ra=ra, dec=dec, created_on=created_on).execute()
+                excess = Resolved.select().count() - self.max_rows
+                if excess > 0:
+                    oldest = Resolved.select(Resolved.name).order_by(Resolved.created_on).limit(excess)
+                    Resolved.delete().where(Resolved.name.in_(oldest)).execute()
+        except PeeweeException as e:
+            logger.warning("Cannot write name cache: %s", e)
+
+    def cached(self, name: str):
+        """Return cached ``(ra, dec)`` of ``name``, or None when it would take a lookup.
+
+        Raises ``NameResolveError`` for names cached as unknown.
+        """
+        key = normalize(name)
+        cached = self._from_memory(key) or self._from_disk(key)
+        if cached is None:
+            return None
+
+        coords, expires = cached
+        self._remember(key, coords, expires)
+        if coords is None:
+            self.stats["negative_hits"] += 1
+            raise NameResolveError(f"Unable to find coordinates for name '{name}'")
+
+        return coords
+
+    def resolve(self, name: str):
+        """Return ``(ra, dec)`` of ``name`` in hours and degrees."""
+        coords = self.cached(name)
+        if coords is not None:
+            return coords
+
+        key = normalize(name)
+        self.stats["misses"] += 1
+        created_on = datetime.utcnow()
+        try:
+            sky = SkyCoord.from_name(name)
+        except NameResolveError:
+            self._store(key, None, created_on)
+            self._remember(key, None, self._expires(created_on, None))
+            raise
+
+        coords = (sky.ra.hour, sky.dec.degree)
+        self._store(key, coords, created_on)
+        self._remember(key, coords, self._expires(created_on, coords))
+        return coords
+
+    def purge(self) -> int:
+        """Delete expired rows from the SQLite tier. Returns the number of deleted rows."""
+        now = datetime.utcnow()
+        with self._lock:
+            self._memory.clear()
+        self._create()
+        return Resolved.delete().where(
+            (Resolved.ra.is_null(False) & (Resolved.created_on < now - self.ttl)) |
+            (Resolved.ra.is_null() & (Resolved.created_on < now - self.negative_ttl))
+        ).execute()
+
+
+resolver = Resolver()
+registry.track("art_cache_total", resolver.stats, cache="resolver")
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from . import fast
+
+# Altitudes and hour angles are sampled on this grid (days) around the
+# requested time, then crossings are refined with regula falsi steps.
+STEP = 10 / 1440
+WINDOW = 0.51
+REFINE = 3
+
+
+def to_datetime(jd: float) -> datetime:
+    return datetime(2000, 1, 1, 12) + timedelta(days=float(jd) - fast.J2000)
+
+
+def _refine(f, t0, t1, y0, y1, level):
+    for _ in range(REFINE):
+        t = t0 + (level - y0) * (t1 - t0) / (y1 - y0)
+        y = f(t)
+        left = np.sign(y - level) == np.sign(y0 - level)
+        t0, y0 = np.where(left, t, t0), np.where(left, y, y0)
+        t1, y1 = np.where(left, t1, t), np.where(left, y1, y)
+
+    return t0 + (level - y0) * (t1 - t0) / (y1 - y0)
+
+
+def _nearest(jd: float, count: int, targets, times, mask):
+    # Assignment with repeated indices keeps the last value, so write the
+    # candidates from the farthest to the nearest.
+    best = np.full(count, np.nan)
+    order = np.argsort(-np.abs(times[mask] - jd))
+    best[targets[mask][order]] = times[mask][order]
+    return best
+
+
+def crossings(jd: float, grid, values, f, level: float):
+    """Rising and setting crossings of ``level`` nearest to ``jd``.
+
+    ``values`` are sampled on ``grid`` with shape ``(times, targets)``;
+    ``f(t, n)`` evaluates targets ``n`` at times ``t`` to refine them.
+    """
+    above = values > level
+    i, n = np.nonzero(above[:-1] != above[1:])
+    times = _refine(lambda t: f(t, n), grid[i], grid[i + 1], values[i, n], values[i + 1, n], level)
+    rising = values[i + 1, n] > values[i, n]
+
+    count = values.shape[1]
+    return _nearest(jd, count, n, times, rising), _nearest(jd, count, n, times, ~rising)
+
+
+def solve(ra, dec, jd: float, longitude: float, latitude: float, horizon: float = 0.0) -> dict:
+    """Rise, set and transit Julian dates nearest to ``jd`` for every target.
+
+    ``ra`` (hours) and ``dec`` (degrees) are arrays of targets. Missing events
+    are NaN; ``status`` is ``"circumpolar"``, ``"never"`` (never rises) or
+    ``"rises"``.
+    """
+    ra = np.atleast_1d(np.asarray(ra, dtype=float))
+    dec = np.atleast_1d(np.asarray(dec, dtype=float))
+    grid = jd + np.arange(-WINDOW, WINDOW + STEP, STEP)
+
+    alt, _ = fast.altaz(ra[None, :], dec[None, :], grid[:, None], longitude, latitude)
+    ha, _ = fast.hour_angle(ra[None, :], dec[None, :], grid[:, None], longitude)
+
+    rise, set_ = crossings(jd, grid, alt, lambda t, n: fast.altaz(ra[n], dec[n], t, longitude, latitude)[0],
+                           horizon)
+
+    ti, tn = np.nonzero((ha[:-1] < 0) & (ha[1:] >= 0) & (ha[1:] - ha[:-1] < 180))
+    transits = _refine(lambda t: fast.hour_angle(ra[tn], dec[tn], t, longitude)[0],
+                       grid[ti], grid[ti + 1], ha[ti, tn], ha[ti + 1, tn], 0.0)
+
+    above = alt > horizon
+    status = np.where(above.all(axis=0), "circumpolar", np.where(above.any(axis=0), "rises", "never"))
+    return {
+        "rise": rise,
+        "set": set_,
+        "transit": _nearest(jd, len(ra), tn, transits, np.ones(len(tn), dtype=bool)),
+        "status": status.tolist()
+    }
@@ -0,0 +1,154 @@
+import asyncio
+import os
+from collections import OrderedDict, deque
+from time import monotonic
+from typing import Any
+
+# Cost classes, served in this order
+CHEAP, NORMAL, EXPENSIVE = "cheap", "normal", "expensive"
+CLASSES = (CHEAP, NORMAL, EXPENSIVE)
+
+# Names missing from the catalog may wait seconds for Sesame, so a lookup is not cheap
+COSTS = {
+    "from_name": NORMAL,
+    "from_names": NORMAL,
+    "sidereal": CHEAP,
+    "eq2hor": CHEAP,
+    "twilight": NORMAL,
+    "moon": NORMAL,
+    "rise_set": NORMAL,
+    "visibility": NORMAL,
+    "eq2hor_batch": NORMAL,
+    "rise_set_batch": NORMAL,
+    "chart": NORMAL,
+}
+# Rate limit tokens a job of each class takes
+TOKENS = {CHEAP: 0, NORMAL: 1, EXPENSIVE: 3}
+
+
+def classify(operation: str, kwargs: dict, large: int) -> str:
+    """The cost class of a job; batches of more than ``large`` targets are expensive."""
+    cost = COSTS.get(operation, NORMAL)
+    size = len(kwargs.get("targets") or kwargs.get("ras") or kwargs.get("names") or ())
+    if cost == NORMAL and size > large:
+        return EXPENSIVE
+
+    return cost
+
+
+class Busy(Exception):
+    """The scheduler has no room for a job. ``reason`` is ``user``, ``queue`` or ``rate``."""
+
+    def __init__(self, reason: str) -> None:
+        super().__init__(f"Busy ({reason})")
+        self.reason = reason
+
+
+class Scheduler:
+    """Admission control and priority in front of an ``Executor``.
+
+    At most ``slots`` jobs run at once. Waiting jobs start cheapest class
+    first; one slot is kept for cheap jobs and expensive jobs take at most
+    ``expensive`` slots. A job is rejected with ``Busy`` instead of waiting
+    when its class already has ``queues[class]`` jobs waiting, when its user
+    has ``user_jobs`` jobs waiting or running, or when the user's token bucket
+    (``rate`` tokens per second up to ``burst``, see ``TOKENS``) is empty.
+    Jobs submitted with ``metered=False`` skip the bucket, for work a later
+    job of the same request pays for. Buckets of at most ``users`` users are
+    kept. Defaults are read from ``ART_SCHED_SLOTS`` (the executor's workers),
+    ``ART_SCHED_EXPENSIVE``, ``ART_SCHED_QUEUES`` (cheap, normal and
+    expensive, ``200,50,10``), ``ART_SCHED_USER_JOBS``, ``ART_SCHED_RATE``,
+    ``ART_SCHED_BURST`` and ``ART_SCHED_LARGE`` (targets that make a batch
+    expensive).
+    """
+
+    def __init__(self, executor, slots: int = None, expensive: int = None, queues: dict = None,
+                 user_jobs: int = None, rate: float = None, burst: float = None, large: int = None,
+                 users: int = 10000) -> None:
+        self.executor = executor
+        self.slots = slots or int(os.environ.get("ART_SCHED_SLOTS", executor.workers))
+        self.expensive = expensive or int(os.environ.get("ART_SCHED_EXPENSIVE", max(1, self.slots // 2)))
+        self.queues = queues or dict(zip(CLASSES, map(int, os.environ.get("ART_SCHED_QUEUES",
+                                                                          "200,50,10").split(","))))
+        self.user_jobs = user_jobs or int(os.environ.get("ART_SCHED_USER_JOBS", 2))
+        self.rate = rate or float(os.environ.get("ART_SCHED_RATE", 0.5))
+        self.burst = burst or float(os.environ.get("ART_SCHED_BURST", 6))
+        self.large = large or int(os.environ.get("ART_SCHED_LARGE", 5))
+        self.users = users
+        self.stats = {"accepted": 0, "rejected_user": 0, "rejected_queue": 0, "rejected_rate": 0}
+
+        self._waiting = {cost: deque() for cost in CLASSES}
+        self._running = dict.fromkeys(CLASSES, 0)
+        self._jobs = {}
+        self._buckets = OrderedDict()
+
+    def depth(self, cost: str) -> int:
+        return len(self._waiting[cost])
+
+    def _reject(self, reason: str):
+        self.stats[f"rejected_{reason}"] += 1
+        raise Busy(reason)
+
+    def _take(self, user, tokens: float) -> bool:
+        if not tokens:
+            return True
+
+        # A burst smaller than the cost would never let the job run
+        tokens = min(tokens, self.burst)
+        now = monotonic()
+        available, updated = self._buckets.pop(user, (self.burst, now))
+        available = min(self.burst, available + (now - updated) * self.rate)
+        taken = available >= tokens
+        if taken:
+            available -= tokens
+
+        self._buckets[user] = (available, now)
+        while len(self._buckets) > self.users:
+            self._buckets.popitem(last=False)
+        return taken
+
+    def _free(self, cost: str) -> bool:
+        running = sum(self._running.values())
+        if cost == CHEAP:
+            return running < self.slots
+        if cost == EXPENSIVE and self._running[EXPENSIVE] >= self.expensive:
+            return False
+
+        return running < max(1, self.slots - 1)
+
+    def _dispatch(self) -> None:
+        for cost in CLASSES:
+            waiting = self._waiting[cost]
+            while waiting and self._free(cost):
+                self._running[cost] += 1
+                waiting.popleft().set_result(None)
+
+    async def submit(self, operation: str, timeout: float = None, user=None, metered: bool = True,
+                     **kwargs) -> Any:
+        """Run a job on the executor once a slot is free. Raises ``Busy`` right away when there is no room."""
+        cost = classify(operation, kwargs, self.large)
+        if user is not None and self._jobs.get(user, 0) >= self.user_jobs:
+            self._reject("user")
+        if len(self._waiting[cost]) >= self.queues[cost]:
+            self._reject("queue")
+        if user is not None and metered and not self._take(user, TOKENS[cost]):
+            self._reject("rate")
+
+        self.stats["accepted"] += 1
+        self._jobs[user] = self._jobs.get(user, 0) + 1
+        slot = asyncio.get_running_loop().create_future()
+        self._waiting[cost].append(slot)
+        try:
+            self._dispatch()
+            await slot
+            return await self.executor.submit(operation, timeout, **kwargs)
+        finally:
+            if slot.cancelled():
+                self._waiting[cost].remove(slot)
+            else:
+                self._running[cost] -= 1
+                self._dispatch()
+
+            self._jobs[user] -= 1
+            if not self._jobs[user]:
+                del self._jobs[user]
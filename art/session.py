@@ -0,0 +1,211 @@
+"""Per-user conversation state of the bot and its SQLite persistence."""
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from time import monotonic
+
+from peewee import Model, SqliteDatabase, BigIntegerField, CharField, DateTimeField, FloatField, IntegerField, \
+    CompositeKey, chunked
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+db = SqliteDatabase(os.environ.get("ART_SESSION_DB", "requests.db"), pragmas={
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "busy_timeout": 5000,
+})
+
+
+class Session:
+    """What a user gave so far in a conversation: a time as a Julian date and a location.
+
+    Used as ``context.user_data``. ``time`` builds an ``art.Time`` from ``jd``
+    on each access, so no astropy object is kept between the steps of a
+    conversation. ``touched`` is the ``monotonic`` time of the user's last update.
+    """
+
+    __slots__ = ("jd", "latitude", "longitude", "touched")
+
+    def __init__(self, jd: float = None, latitude: float = None, longitude: float = None) -> None:
+        self.jd = jd
+        self.latitude = latitude
+        self.longitude = longitude
+        self.touched = monotonic()
+
+    @property
+    def time(self):
+        if self.jd is None:
+            return None
+
+        from .tm import Time
+
+        time = Time(self.jd, format="jd")
+        time.dt.format = "isot"
+        return time
+
+    @time.setter
+    def time(self, value) -> None:
+        self.jd = float(value.dt.jd)
+
+    @property
+    def location(self):
+        if self.latitude is None:
+            return None
+
+        return self.latitude, self.longitude
+
+    @location.setter
+    def location(self, value: tuple) -> None:
+        self.latitude, self.longitude = map(float, value)
+
+    @property
+    def empty(self) -> bool:
+        return self.jd is None and self.latitude is None
+
+    def touch(self) -> None:
+        self.touched = monotonic()
+
+    def clear(self) -> None:
+        self.jd = self.latitude = self.longitude = None
+
+    def __repr__(self) -> str:
+        return f"Session(jd={self.jd}, latitude={self.latitude}, longitude={self.longitude})"
+
+
+class UserSession(Model):
+    user = BigIntegerField(primary_key=True)
+    jd = FloatField(null=True)
+    latitude = FloatField(null=True)
+    longitude = FloatField(null=True)
+    updated_on = DateTimeField(index=True)
+
+    class Meta:
+        database = db
+
+
+class ConversationState(Model):
+    name = CharField()
+    key = CharField()
+    state = IntegerField()
+    updated_on = DateTimeField(index=True)
+
+    class Meta:
+        database = db
+        primary_key = CompositeKey("name", "key")
+
+
+class SessionPersistence(BasePersistence):
+    """Keeps ``Session`` user data and conversation states in SQLite across restarts.
+
+    The application hands over what changed every ``update_interval`` seconds.
+    Changes are only collected until ``flush`` writes them in one transaction,
+    which the bot runs on the same interval and the application calls when it
+    stops; empty sessions are deleted instead. Rows untouched for ``timeout``
+    seconds are not loaded again. Defaults are read from ``ART_SESSION_DB``,
+    ``ART_SESSION_FLUSH`` and ``ART_SESSION_TIMEOUT``.
+    """
+
+    def __init__(self, update_interval: float = None, timeout: float = None) -> None:
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval or float(os.environ.get("ART_SESSION_FLUSH", 60)),
+        )
+        self.timeout = timeout or float(os.environ.get("ART_SESSION_TIMEOUT", 1800))
+        self.stats = {"written": 0, "deleted": 0, "flushes": 0}
+        # Changes waiting to be written: None deletes the row
+        self._users = {}
+        self._conversations = {}
+        self._lock = asyncio.Lock()
+
+    def _expired(self) -> datetime:
+        return datetime.utcnow() - timedelta(seconds=self.timeout)
+
+    def _load_users(self) -> dict:
+        db.create_tables([UserSession, ConversationState])
+        UserSession.delete().where(UserSession.updated_on < self._expired()).execute()
+        return {row.user: Session(row.jd, row.latitude, row.longitude) for row in UserSession.select()}
+
+    def _load_conversations(self, name: str) -> dict:
+        db.create_tables([UserSession, ConversationState])
+        ConversationState.delete().where(ConversationState.updated_on < self._expired()).execute()
+        return {tuple(json.loads(row.key)): row.state
+                for row in ConversationState.select().where(ConversationState.name == name)}
+
+    async def get_user_data(self) -> dict:
+        return await asyncio.to_thread(self._load_users)
+
+    async def get_conversations(self, name: str) -> dict:
+        return await asyncio.to_thread(self._load_conversations, name)
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    def _write(self, users: dict, conversations: dict) -> None:
+        now = datetime.utcnow()
+        deleted = [user for user, session in users.items() if session is None or session.empty]
+        rows = [{"user": user, "jd": session.jd, "latitude": session.latitude, "longitude": session.longitude,
+                 "updated_on": now} for user, session in users.items() if session is not None and not session.empty]
+        ended = [(name, key) for (name, key), state in conversations.items() if state is None]
+        states = [{"name": name, "key": key, "state": state, "updated_on": now}
+                  for (name, key), state in conversations.items() if state is not None]
+
+        with db.atomic():
+            for chunk in chunked(deleted, 500):
+                UserSession.delete().where(UserSession.user.in_(chunk)).execute()
+            for chunk in chunked(rows, 100):
+                UserSession.insert_many(chunk).on_conflict_replace().execute()
+            for name, key in ended:
+                ConversationState.delete().where((ConversationState.name == name) &
+                                                 (ConversationState.key == key)).execute()
+            for chunk in chunked(states, 100):
+                ConversationState.insert_many(chunk).on_conflict_replace().execute()
+
+        self.stats["written"] += len(rows) + len(states)
+        self.stats["deleted"] += len(deleted) + len(ended)
+        self.stats["flushes"] += 1
+
+    async def flush(self) -> None:
+        async with self._lock:
+            users, conversations = self._users, self._conversations
+            self._users, self._conversations = {}, {}
+            if users or conversations:
+                await asyncio.to_thread(self._write, users, conversations)
+
+    async def update_user_data(self, user_id: int, data: Session) -> None:
+        self._users[user_id] = data
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._users[user_id] = None
+
+    async def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        self._conversations[name, json.dumps(key)] = new_state
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: Session) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
@@ -0,0 +1,93 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+import numpy as np
+from astropy.coordinates import EarthLocation, AltAz
+from astropy import units
+from astropy.time import Time as aTime
+
+from .metrics import registry
+
+if TYPE_CHECKING:
+    from astroplan import Observer
+
+
+class Site:
+    """An observing site with its ``EarthLocation``, astroplan ``Observer`` and recent ``AltAz`` frames.
+
+    Safe to share between the threads of a thread pool executor.
+    """
+
+    frames = 8
+
+    def __init__(self, longitude: float, latitude: float, altitude: float) -> None:
+        self.longitude = longitude
+        self.latitude = latitude
+        self.altitude = altitude
+
+        self.location = EarthLocation(longitude * units.deg, latitude * units.deg, altitude * units.m)
+        self._observer = None
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def observer(self) -> "Observer":
+        if self._observer is None:
+            # astroplan takes a while to import and only the full precision path needs it
+            from astroplan import Observer
+            self._observer = Observer(self.location)
+
+        return self._observer
+
+    def altaz(self, obstime: aTime) -> AltAz:
+        key = (obstime.shape, np.asarray(obstime.jd1).tobytes(), np.asarray(obstime.jd2).tobytes())
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+                return frame
+
+            frame = self._frames[key] = AltAz(obstime=obstime, location=self.location)
+            while len(self._frames) > self.frames:
+                self._frames.popitem(last=False)
+
+        return frame
+
+
+class SiteRegistry:
+    """LRU of ``Site`` objects keyed on location rounded to ``precision`` decimal degrees and whole metres.
+
+    Defaults are read from ``ART_SITE_PRECISION`` and ``ART_SITE_CACHE_SIZE``.
+    """
+
+    def __init__(self, precision: int = None, size: int = None) -> None:
+        self.precision = precision if precision is not None else int(os.environ.get("ART_SITE_PRECISION", 2))
+        self.size = size or int(os.environ.get("ART_SITE_CACHE_SIZE", 256))
+        self.stats = {"hits": 0, "misses": 0}
+        self._sites = OrderedDict()
+        self._lock = threading.Lock()
+
+    def quantize(self, longitude: float, latitude: float, altitude: float) -> tuple:
+        return round(longitude, self.precision), round(latitude, self.precision), round(altitude)
+
+    def get(self, longitude: float, latitude: float, altitude: float) -> Site:
+        key = self.quantize(longitude, latitude, altitude)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is not None:
+                self.stats["hits"] += 1
+                self._sites.move_to_end(key)
+                return site
+
+            self.stats["misses"] += 1
+            site = self._sites[key] = Site(*key)
+            while len(self._sites) > self.size:
+                self._sites.popitem(last=False)
+
+        return site
+
+
+sites = SiteRegistry()
+registry.track("art_cache_total", sites.stats, cache="sites")
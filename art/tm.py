@@ -1,10 +1,16 @@
+import math
+
 from astropy.time import Time as aTime
-from astropy.coordinates import EarthLocation
 from astropy import units
-from astroplan import Observer
 import dateutil.parser
 from _datetime import datetime
 
+from .ephem import ephemerides
+from .iers import snapshot  # noqa: F401  pins astropy to the local IERS tables
+from .metrics import timed
+from .riseset import to_datetime
+from .site import sites
+
 
 def auto_parse(dt: str):
     return dateutil.parser.parse(dt).strftime("%Y-%m-%dT%H:%M:%S.%f")
@@ -14,22 +20,36 @@ def now():
     return datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f")
 
 
+def clock(jd: float):
+    if math.isnan(jd):
+        return None
+
+    return to_datetime(jd).strftime("%H:%M:%S")
+
+
 class Time:
+    @timed("Time")
     def __init__(self, dt: str, scale: str = "utc", format: str = "isot") -> None:
         self.dt = aTime(dt, scale=scale, format=format)
 
+    @timed("Time.jd")
     def jd(self):
         return {
             "jd": self.dt.jd,
             "mjd": self.dt.mjd
         }
 
+    @timed("Time.sidereal")
     def sidereal(self, longitude: float):
         return self.dt.sidereal_time("mean", longitude * units.deg).to_string(sep=":")
 
-    def twilight(self, longitude: float, latitude: float, altitude: float):
-        site = EarthLocation(longitude * units.deg, latitude * units.deg, altitude * units.m)
-        obs = Observer(site)
+    @timed("Time.twilight")
+    def twilight(self, longitude: float, latitude: float, altitude: float, precision: str = "full"):
+        if precision == "fast":
+            tw = ephemerides.get(self.dt.jd).twilight(self.dt.jd, longitude, latitude)
+            return {key: clock(value) for key, value in tw.items()}
+
+        obs = sites.get(longitude, latitude, altitude).observer
         return {
             "morning": obs.twilight_morning_astronomical(
                 self.dt, which="nearest").strftime("%H:%M:%S"),
@@ -37,9 +57,17 @@ class Time:
                 self.dt, which="nearest").strftime("%H:%M:%S")
         }
 
-    def moon(self, longitude: float, latitude: float, altitude: float):
-        site = EarthLocation(longitude * units.deg, latitude * units.deg, altitude * units.m)
-        obs = Observer(site)
+    @timed("Time.moon")
+    def moon(self, longitude: float, latitude: float, altitude: float, precision: str = "full"):
+        if precision == "fast":
+            mn = ephemerides.get(self.dt.jd).moon(self.dt.jd, longitude, latitude)
+            return {
+                "rise": clock(mn["rise"]),
+                "set": clock(mn["set"]),
+                "phase": round(mn["phase"], 4)
+            }
+
+        obs = sites.get(longitude, latitude, altitude).observer
 
         return {
             "rise": obs.moon_rise_time(self.dt, which="nearest").strftime("%H:%M:%S"),
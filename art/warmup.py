@@ -0,0 +1,62 @@
+import logging
+import os
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+# Doğu Anadolu Gözlemevi and the Crab Nebula
+SITE = (41.2333, 39.7833, 3170.0)
+TARGET = ("M1", 5.5756, 22.0145)
+
+_timings = None
+
+
+def enabled() -> bool:
+    return os.environ.get("ART_WARMUP", "0").lower() in ("1", "true", "yes")
+
+
+def run(precision: str = None) -> dict:
+    """Run each slow first call once in this process and return how long each took in seconds.
+
+    IERS tables, astroplan, ephemerides and matplotlib's font cache are set up
+    here instead of during a user's request. Later calls return the first
+    timings without doing anything. A failing step is logged and skipped.
+    """
+    global _timings
+    if _timings is not None:
+        return _timings
+
+    from .chart import visibility as visibility_chart
+    from .obj import Object, ObjectCollection
+    from .tm import Time, now
+
+    precision = precision or os.environ.get("ART_PRECISION", "full")
+    time = Time(now())
+    label, ra, dec = TARGET
+
+    def chart():
+        times, altitudes = ObjectCollection([ra], [dec]).visibility(time, *SITE, precision)
+        visibility_chart(times, altitudes, [label])
+
+    steps = {
+        "eq2hor": lambda: Object(ra, dec).eq2hor(time, *SITE, precision),
+        "twilight": lambda: time.twilight(*SITE, precision),
+        "moon": lambda: time.moon(*SITE, precision),
+        "rise_set": lambda: ObjectCollection([ra], [dec]).rise_set(time, *SITE, precision),
+        "chart": chart,
+    }
+
+    timings = {}
+    for name, step in steps.items():
+        start = perf_counter()
+        try:
+            step()
+        except Exception:
+            logger.exception("Warm-up of %s failed", name)
+            continue
+
+        timings[name] = perf_counter() - start
+        logger.info("Warm-up of %s took %.2f s (pid %d)", name, timings[name], os.getpid())
+
+    _timings = timings
+    return timings
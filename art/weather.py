@@ -1,17 +1,69 @@
+import asyncio
 import math
+import os
+import random
+from collections import OrderedDict
+from time import monotonic
 
-import requests
+import httpx
+
+from .metrics import timed
 
 
 class Weather:
-    def __init__(self):
-        self.apikey = "71a299a755a1d0b5b5ed8a483ed22e82"
-
-    def get(self, longitude: float, latitude: float):
-        r = requests.get(
-            f"https://api.openweathermap.org/data/2.5/weather?lat={latitude}&lon={longitude}&units=metric&appid={self.apikey}"
-        )
-        if r.ok:
+    """Asynchronous OpenWeatherMap client sharing one pooled HTTP connection.
+
+    At most ``concurrency`` requests run at once; transport errors, 429 and
+    5xx responses are retried ``retries`` times with jittered exponential
+    backoff. Defaults are read from ``WEATHERAPI`` (the API key),
+    ``ART_WEATHER_URL``, ``ART_WEATHER_TIMEOUT``, ``ART_WEATHER_CONCURRENCY``
+    and ``ART_WEATHER_RETRIES``.
+    """
+
+    def __init__(self, apikey: str = None, base_url: str = None, timeout: float = None,
+                 concurrency: int = None, retries: int = None, backoff: float = 0.25) -> None:
+        self.apikey = apikey or os.environ.get("WEATHERAPI")
+        self.base_url = base_url or os.environ.get("ART_WEATHER_URL", "https://api.openweathermap.org/data/2.5")
+        self.timeout = timeout or float(os.environ.get("ART_WEATHER_TIMEOUT", 5))
+        self.concurrency = concurrency or int(os.environ.get("ART_WEATHER_CONCURRENCY", 10))
+        self.retries = retries if retries is not None else int(os.environ.get("ART_WEATHER_RETRIES", 2))
+        self.backoff = backoff
+
+        self._client = None
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 3)),
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            )
+
+        return self._client
+
+    async def _fetch(self, longitude: float, latitude: float) -> httpx.Response:
+        params = {"lat": latitude, "lon": longitude, "units": "metric", "appid": self.apikey}
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._semaphore:
+                    r = await self.client.get("/weather", params=params)
+                if r.status_code != 429 and r.status_code < 500:
+                    return r
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+        return r
+
+    @timed("Weather.get")
+    async def get(self, longitude: float, latitude: float):
+        r = await self._fetch(longitude, latitude)
+        if r.is_success:
             data = r.json()
             description = data["weather"][0]["description"]
             temp = data["main"]["temp"]
@@ -29,3 +81,126 @@ class Weather:
                 "humidity": humidity,
                 "wind": wind
             }
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(latitude: float, longitude: float, precision: int = 6) -> str:
+    lat, lon = [-90.0, 90.0], [-180.0, 180.0]
+    code, bits, bit, even = [], 0, 0, True
+    while len(code) < precision:
+        interval, value = (lon, longitude) if even else (lat, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        if value >= middle:
+            bits = bits * 2 + 1
+            interval[0] = middle
+        else:
+            bits = bits * 2
+            interval[1] = middle
+
+        even = not even
+        bit += 1
+        if bit == 5:
+            code.append(BASE32[bits])
+            bits, bit = 0, 0
+
+    return "".join(code)
+
+
+class WeatherCache:
+    """Stale-while-revalidate cache of ``Weather.get`` keyed on geohash cells.
+
+    Observations younger than ``ttl`` seconds are served directly; older ones
+    up to ``stale`` seconds are served while one background request refreshes
+    the cell. Concurrent misses of a cell share one upstream request. After
+    ``failures`` consecutive upstream failures the circuit opens for
+    ``cooldown`` seconds and only cached observations, however old, are
+    served. Defaults are read from ``ART_WEATHER_PRECISION`` (geohash length,
+    6 is about 1.2 x 0.6 km), ``ART_WEATHER_TTL``, ``ART_WEATHER_STALE``,
+    ``ART_WEATHER_FAILURES``, ``ART_WEATHER_COOLDOWN`` and
+    ``ART_WEATHER_CACHE_SIZE``.
+    """
+
+    def __init__(self, weather: Weather, precision: int = None, ttl: float = None, stale: float = None,
+                 failures: int = None, cooldown: float = None, size: int = None) -> None:
+        self.weather = weather
+        self.precision = precision or int(os.environ.get("ART_WEATHER_PRECISION", 6))
+        self.ttl = ttl or float(os.environ.get("ART_WEATHER_TTL", 600))
+        self.stale = stale or float(os.environ.get("ART_WEATHER_STALE", 3600))
+        self.failures = failures or int(os.environ.get("ART_WEATHER_FAILURES", 5))
+        self.cooldown = cooldown or float(os.environ.get("ART_WEATHER_COOLDOWN", 60))
+        self.size = size or int(os.environ.get("ART_WEATHER_CACHE_SIZE", 10000))
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0, "upstream_errors": 0}
+
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._failed = 0
+        self._open_until = 0.0
+
+    @property
+    def open(self) -> bool:
+        return monotonic() < self._open_until
+
+    async def _fetch(self, cell: str, longitude: float, latitude: float):
+        try:
+            data = await self.weather.get(longitude, latitude)
+        except (httpx.HTTPError, ValueError, KeyError):
+            data = None
+
+        if data is None:
+            self.stats["upstream_errors"] += 1
+            self._failed += 1
+            if self._failed >= self.failures:
+                self._open_until = monotonic() + self.cooldown
+            entry = self._entries.get(cell)
+            return entry[0] if entry is not None else None
+
+        self._failed = 0
+        self._entries[cell] = (data, monotonic())
+        self._entries.move_to_end(cell)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+        return data
+
+    def _refresh(self, cell: str, longitude: float, latitude: float) -> asyncio.Task:
+        task = self._inflight.get(cell)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            return task
+
+        task = asyncio.get_running_loop().create_task(self._fetch(cell, longitude, latitude))
+        self._inflight[cell] = task
+        task.add_done_callback(lambda _: self._inflight.pop(cell, None))
+        return task
+
+    async def get(self, longitude: float, latitude: float):
+        cell = geohash(latitude, longitude, self.precision)
+        entry = self._entries.get(cell)
+        if entry is not None:
+            data, fetched = entry
+            age = monotonic() - fetched
+            if age < self.ttl:
+                self.stats["hits"] += 1
+                return data
+
+            if age < self.stale or self.open:
+                self.stats["stale_hits"] += 1
+                if not self.open:
+                    self._refresh(cell, longitude, latitude)
+                return data
+
+        if self.open:
+            return None
+
+        self.stats["misses"] += 1
+        return await asyncio.shield(self._refresh(cell, longitude, latitude))
+
+    async def close(self) -> None:
+        await self.weather.close()
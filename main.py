@@ -1,13 +1,24 @@
-import io
+import asyncio
+import html
 import json
 import logging
-from datetime import datetime
 import os
+from concurrent.futures.process import BrokenProcessPool
+from time import monotonic, perf_counter
 from telegram import __version__ as TG_VER
-from art import auto_parse, now, Time, Object, Weather
+from art import auto_parse, metrics, now, Time, Weather
+from art.audit import migrate, request_log
+from art.catalog import catalog
+from art.chart_cache import ChartCache
+from art.compute import Executor
+from art.iers import snapshot
+from art.resolver import resolver
+from art.scheduler import CLASSES, Busy, Scheduler
+from art.session import Session, SessionPersistence
+from art.site import sites
+from art.weather import WeatherCache
 from astropy.coordinates.name_resolve import NameResolveError
-from matplotlib import pyplot as plt
-import matplotlib.dates as mdates
+from peewee import PeeweeException
 
 try:
     from telegram import __version_info__
@@ -21,37 +32,38 @@ if __version_info__ < (20, 0, 0, "alpha", 1):
         f"visit https://docs.python-telegram-bot.org/en/v{TG_VER}/examples.html"
     )
 from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove, Update
+from telegram.error import BadRequest
+from telegram.request import BaseRequest, HTTPXRequest
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
     CommandHandler,
     ContextTypes,
     ConversationHandler,
     MessageHandler,
+    TypeHandler,
     filters,
 )
 
-from peewee import Model, SqliteDatabase, CharField, DateTimeField, TextField
-
-db = SqliteDatabase('requests.db')
-
-
-class Request(Model):
-    created_on = DateTimeField()
-    created_by = CharField()
-    operation = CharField()
-    inputs = TextField()
-    output = TextField()
-
-    class Meta:
-        database = db
-
-
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
 logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("apscheduler").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+executor = Executor()
+scheduler = Scheduler(executor)
+precision = os.environ.get("ART_PRECISION", "full")
+charts = ChartCache()
+weather_client = WeatherCache(Weather())
+metrics.registry.track("art_cache_total", charts.stats, cache="charts")
+metrics.registry.track("art_cache_total", weather_client.stats, cache="weather")
+metrics.registry.gauge("art_queue_depth", lambda: executor.pending, queue="executor")
+metrics.registry.track("art_scheduler_total", scheduler.stats)
+for cost in CLASSES:
+    metrics.registry.gauge("art_queue_depth", lambda cost=cost: scheduler.depth(cost), queue=cost)
+
 START, JD_ASK, SIDEREAL_TIME_ASK, SIDEREAL_LOCATION_ASK, TWILIGHT_TIME_ASK, TWILIGHT_LOCATION_ASK, MOON_TIME_ASK, \
     MOON_LOCATION_ASK, RISESET_TIME_ASK, RISESET_LOCATION_ASK, RISESET_OBJECT_ASK, E2H_TIME_ASK, E2H_LOCATION_ASK, \
     E2H_OBJECT_ASK, VIS_TIME_ASK, VIS_LOCATION_ASK, VIS_OBJECT_ASK, WEATHER_LOCATION_ASK = range(18)
@@ -66,24 +78,61 @@ markup = ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True)
 
 
 def variable_reset(context):
-    if "tm" in context.user_data:
-        del context.user_data["tm"]
+    context.user_data.clear()
 
-    if "loc" in context.user_data:
-        del context.user_data["loc"]
 
+async def did_you_mean(text):
+    # Fuzzy matching against a large ART_CATALOG takes a while, keep it off the event loop
+    suggestions = await asyncio.to_thread(catalog.search, text.strip())
+    if not suggestions:
+        return ""
 
-def saver(update, operation, inputs, output):
-    record = Request(
-        created_on=datetime.utcnow(),
-        created_by=update.message.from_user['id'],
-        operation=operation,
-        inputs=inputs,
-        output=output
-    )
-    record.save()
+    return f"Did you mean: {', '.join(suggestions)}?\n"
+
+
+def known(lines):
+    """``(line, [label, ra, dec])`` of lines answered without a lookup, ``(line, None)`` for names to look up."""
+    skys = []
+    for line in lines:
+        try:
+            ra, dec = map(float, line.split())
+            skys.append((line, ["Coord", ra, dec]))
+            continue
+        except ValueError:
+            pass
+
+        try:
+            coords = catalog.get(line) or resolver.cached(line)
+        except NameResolveError:
+            continue
+        skys.append((line, [line, *coords] if coords else None))
+
+    return skys
+
+
+async def resolve(text, user=None):
+    """Resolve every line of ``text`` to ``[label, ra, dec]``, skipping lines that cannot be parsed."""
+    lines = [each.strip() for each in text.split("\n") if each.strip()]
+    with metrics.timer("resolve"):
+        # Coordinates, catalog names and cached names are answered here without touching the rate limit
+        skys = await asyncio.to_thread(known, lines)
+        names = list(dict.fromkeys(line for line, sky in skys if sky is None))
+        found = {}
+        if names:
+            # One job looks up every name of the message; the batch or chart job that follows pays for it
+            coords = await scheduler.submit("from_names", user=user, metered=False, names=names)
+            found = {name: [name, *each] for name, each in zip(names, coords) if each is not None}
 
+    return [sky or found[line] for line, sky in skys if sky or line in found]
 
+
+async def saver(update, operation, inputs, output):
+    metrics.registry.count("art_requests_total", operation=operation)
+    with metrics.timer("saver"):
+        await request_log.put(update.message.from_user['id'], operation, inputs, output)
+
+
+@metrics.handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Start the conversation and ask user for input."""
     variable_reset(context)
@@ -95,6 +144,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return START
 
 
+@metrics.handler
 async def weather(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     variable_reset(context)
     await update.message.reply_text(
@@ -106,6 +156,23 @@ async def weather(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return WEATHER_LOCATION_ASK
 
 
+async def weather_unavailable(update: Update) -> int:
+    await update.message.reply_text(
+        "Weather service is unavailable at the moment. Please try again later.",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+    return ConversationHandler.END
+
+
+async def session_expired(update: Update) -> int:
+    await update.message.reply_text(
+        "This conversation has expired. Please start again.",
+        reply_markup=markup,
+    )
+    return ConversationHandler.END
+
+
+@metrics.handler
 async def weather_get_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.message.location is None:
         if update.message.text.lower() == "cancel":
@@ -116,8 +183,9 @@ async def weather_get_location(update: Update, context: ContextTypes.DEFAULT_TYP
             return ConversationHandler.END
         try:
             latitude, longitude = map(float, update.message.text.split())
-            wthr = Weather()
-            wthr_data = wthr.get(longitude, latitude)
+            wthr_data = await weather_client.get(longitude, latitude)
+            if wthr_data is None:
+                return await weather_unavailable(update)
             await update.message.reply_text(
                 f"{wthr_data['description'].title()}\n"
                 f"*Temperature:* {wthr_data['temp']} °C\n"
@@ -130,9 +198,9 @@ async def weather_get_location(update: Update, context: ContextTypes.DEFAULT_TYP
                 reply_markup=ReplyKeyboardRemove(),
                 parse_mode="markdown"
             )
-            saver(update, "Weather",
-                  json.dumps({"latitude": latitude, "longitude": longitude}),
-                  f"{json.dumps(wthr_data)}")
+            await saver(update, "Weather",
+                        json.dumps({"latitude": latitude, "longitude": longitude}),
+                        f"{json.dumps(wthr_data)}")
             return ConversationHandler.END
         except:
             await update.message.reply_text(
@@ -146,8 +214,9 @@ async def weather_get_location(update: Update, context: ContextTypes.DEFAULT_TYP
     else:
         latitude = update.message.location.latitude
         longitude = update.message.location.longitude
-        wthr = Weather()
-        wthr_data = wthr.get(longitude, latitude)
+        wthr_data = await weather_client.get(longitude, latitude)
+        if wthr_data is None:
+            return await weather_unavailable(update)
         await update.message.reply_text(
             f"{wthr_data['description'].title()}\n"
             f"*Temperature*: {wthr_data['temp']} °C\n"
@@ -161,12 +230,13 @@ async def weather_get_location(update: Update, context: ContextTypes.DEFAULT_TYP
             parse_mode="markdown"
         )
 
-        saver(update, "Weather",
-              json.dumps({"latitude": latitude, "longitude": longitude}),
-              f"{json.dumps(wthr_data)}")
+        await saver(update, "Weather",
+                    json.dumps({"latitude": latitude, "longitude": longitude}),
+                    f"{json.dumps(wthr_data)}")
         return ConversationHandler.END
 
 
+@metrics.handler
 async def visibility(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     variable_reset(context)
     await update.message.reply_text(
@@ -178,6 +248,7 @@ async def visibility(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return VIS_TIME_ASK
 
 
+@metrics.handler
 async def visibility_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     text = update.message.text
     if text.lower() == "cancel":
@@ -189,7 +260,7 @@ async def visibility_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     if text.lower().strip() == "now":
         tm = Time(now())
-        context.user_data["tm"] = tm
+        context.user_data.time = tm
         await update.message.reply_text(
             "Now give me a location (Latitude ,Longitude): You can share your `location`\n"
             "write cancel to cancel",
@@ -201,7 +272,7 @@ async def visibility_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE
     else:
         try:
             tm = Time(auto_parse(text))
-            context.user_data["tm"] = tm
+            context.user_data.time = tm
 
             await update.message.reply_text(
                 "Now give me a location (Latitude ,Longitude): You can share your `location`\n"
@@ -222,6 +293,7 @@ async def visibility_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE
     return VIS_TIME_ASK
 
 
+@metrics.handler
 async def visibility_get_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.message.location is None:
         try:
@@ -232,7 +304,7 @@ async def visibility_get_location(update: Update, context: ContextTypes.DEFAULT_
                 )
                 return ConversationHandler.END
             latitude, longitude = map(float, update.message.text.split())
-            context.user_data["loc"] = [latitude, longitude]
+            context.user_data.location = latitude, longitude
             await update.message.reply_text(
                 "Now give me a coordinate (Ra ,Dec) or name of an object\n"
                 "write cancel to cancel",
@@ -252,7 +324,7 @@ async def visibility_get_location(update: Update, context: ContextTypes.DEFAULT_
     else:
         latitude = update.message.location.latitude
         longitude = update.message.location.longitude
-        context.user_data["loc"] = [latitude, longitude]
+        context.user_data.location = latitude, longitude
         await update.message.reply_text(
             "Now give me a coordinate (Ra ,Dec) or name of an object\n"
             "write cancel to cancel",
@@ -262,6 +334,7 @@ async def visibility_get_location(update: Update, context: ContextTypes.DEFAULT_
         return VIS_OBJECT_ASK
 
 
+@metrics.handler
 async def visibility_get_sky(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.message.text.lower() == "cancel":
         await update.message.reply_html(
@@ -270,45 +343,52 @@ async def visibility_get_sky(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return ConversationHandler.END
 
-    coords = [each.strip() for each in update.message.text.split("\n")]
-    skys = []
-    for coord in coords:
+    skys = await resolve(update.message.text, update.effective_user.id)
+    if not skys:
+        await update.message.reply_text(
+            f"Cannot pars coordinates.\n"
+            "Please provide two floats (Ra ,Dec) or name of an object per line\n"
+            f"{await did_you_mean(update.message.text)}"
+            "write cancel to cancel",
+            reply_markup=ReplyKeyboardRemove(),
+            parse_mode="markdown"
+        )
+        return VIS_OBJECT_ASK
+
+    tm, location = context.user_data.time, context.user_data.location
+    if tm is None or location is None:
+        return await session_expired(update)
+
+    latitude, longitude = location
+    targets = sorted([f"Coord {obj[1]} {obj[2]}" if obj[0] == "Coord" else obj[0], obj[1], obj[2]] for obj in skys)
+    site_longitude, site_latitude, site_altitude = sites.quantize(longitude, latitude, 0)
+    key = charts.key(tm.dt.isot[:10], (site_longitude, site_latitude, site_altitude), targets,
+                     precision=precision)
+    cached = charts.get(key)
+    if cached is not None and cached.file_id is not None:
         try:
-            skys.append([coord.strip(), Object.from_name(coord.strip())])
-        except NameResolveError:
-            try:
-                ra, dec = map(float, coord.strip().split())
-                skys.append(["Coord", Object(ra, dec)])
-            except:
-                pass
-
-    plt.title("MYRaf Object Visibility")
-    for obj in skys:
-        data = obj[1].visibility(context.user_data["tm"], *context.user_data["loc"], 0)
-        if obj[0] == "Coord":
-            label = f"Coord {obj[1].ra} {obj[1].dec}"
-        else:
-            label = obj[0]
-        plt.plot(data[0], data[1], label=label)
-    plt.legend()
-    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter("%H:%M"))
-    plt.xticks(rotation=45)
-    plt.xlabel("Time (UTC)")
-    plt.ylabel("Altitude (°)")
-    plt.tight_layout()
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-
-    saver(update, "Visibility",
-          json.dumps({"time": str(context.user_data['tm'].dt), "lat": context.user_data['loc'][0],
-                      "lon": context.user_data['loc'][1],
-                      "ra": obj[1].ra, "dec": obj[1].dec}),
-          f"Image")
-    await context.bot.send_photo(chat_id=update.effective_chat.id, photo=buf.read())
+            await context.bot.send_photo(chat_id=update.effective_chat.id, photo=cached.file_id)
+        except BadRequest:
+            cached.file_id = None
+
+    if cached is None:
+        png = await scheduler.submit("chart", user=update.effective_user.id, targets=targets, time=tm.dt.isot,
+                                     longitude=site_longitude, latitude=site_latitude,
+                                     altitude=site_altitude, precision=precision)
+        cached = charts.put(key, png)
+
+    if cached.file_id is None:
+        message = await context.bot.send_photo(chat_id=update.effective_chat.id, photo=cached.png)
+        cached.file_id = message.photo[-1].file_id
+
+    await saver(update, "Visibility",
+                json.dumps({"time": str(tm.dt), "lat": latitude, "lon": longitude,
+                            "ra": [obj[1] for obj in skys], "dec": [obj[2] for obj in skys]}),
+                f"Image")
     return ConversationHandler.END
 
 
+@metrics.handler
 async def e2h(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     variable_reset(context)
     await update.message.reply_text(
@@ -320,6 +400,7 @@ async def e2h(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return E2H_TIME_ASK
 
 
+@metrics.handler
 async def e2h_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     text = update.message.text
     if text.lower() == "cancel":
@@ -331,7 +412,7 @@ async def e2h_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
     if text.lower().strip() == "now":
         tm = Time(now())
-        context.user_data["tm"] = tm
+        context.user_data.time = tm
         await update.message.reply_text(
             "Now give me a location (Latitude ,Longitude): You can share your `location`\n"
             "write cancel to cancel",
@@ -343,7 +424,7 @@ async def e2h_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     else:
         try:
             tm = Time(auto_parse(text))
-            context.user_data["tm"] = tm
+            context.user_data.time = tm
 
             await update.message.reply_text(
                 "Now give me a location (Latitude ,Longitude): You can share your `location`\n"
@@ -364,6 +445,7 @@ async def e2h_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     return E2H_TIME_ASK
 
 
+@metrics.handler
 async def e2h_get_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.message.location is None:
         if update.message.text.lower() == "cancel":
@@ -374,9 +456,9 @@ async def e2h_get_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             return ConversationHandler.END
         try:
             latitude, longitude = map(float, update.message.text.split())
-            context.user_data["loc"] = [latitude, longitude]
+            context.user_data.location = latitude, longitude
             await update.message.reply_text(
-                "Now give me a coordinate (Ra ,Dec) or name of an object\n"
+                "Now give me coordinates (Ra ,Dec) or names of objects, one per line\n"
                 "write cancel to cancel",
                 reply_markup=ReplyKeyboardRemove(),
                 parse_mode="markdown"
@@ -394,9 +476,9 @@ async def e2h_get_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     else:
         latitude = update.message.location.latitude
         longitude = update.message.location.longitude
-        context.user_data["loc"] = [latitude, longitude]
+        context.user_data.location = latitude, longitude
         await update.message.reply_text(
-            "Now give me a coordinate (Ra ,Dec) or name of an object\n"
+            "Now give me coordinates (Ra ,Dec) or names of objects, one per line\n"
             "write cancel to cancel",
             reply_markup=ReplyKeyboardRemove(),
             parse_mode="markdown"
@@ -404,6 +486,7 @@ async def e2h_get_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         return E2H_OBJECT_ASK
 
 
+@metrics.handler
 async def e2h_get_sky(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.message.text.lower() == "cancel":
         await update.message.reply_html(
@@ -411,48 +494,50 @@ async def e2h_get_sky(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
             reply_markup=ReplyKeyboardRemove(),
         )
         return ConversationHandler.END
-    try:
-        sky = Object.from_name(update.message.text.strip())
-        rs = sky.eq2hor(context.user_data["tm"], *context.user_data["loc"], 0)
-        await update.message.reply_html(
-            f"<b>Alt:</b> <pre>{rs['alt']}</pre>\n"
-            f"<b>Az:</b> <pre>{rs['az']}</pre>\n",
+
+    skys = await resolve(update.message.text, update.effective_user.id)
+    if not skys:
+        await update.message.reply_text(
+            f"Cannot pars coordinates.\n"
+            "Please provide two floats (Ra ,Dec) or name of an object per line\n"
+            f"{await did_you_mean(update.message.text)}"
+            "write cancel to cancel",
             reply_markup=ReplyKeyboardRemove(),
+            parse_mode="markdown"
         )
-        saver(update, "E2H",
-              json.dumps({"time": str(context.user_data['tm'].dt), "lat": context.user_data['loc'][0],
-                          "lon": context.user_data['loc'][1]}),
-              f"{json.dumps(rs)}")
+        return E2H_OBJECT_ASK
 
-        return ConversationHandler.END
-    except NameResolveError:
-        try:
-            ra, dec = map(float, update.message.text.strip().split())
-            sky = Object(ra, dec)
-            rs = sky.eq2hor(context.user_data["tm"], *context.user_data["loc"], 0)
-            await update.message.reply_html(
-                f"<b>Alt:</b> <pre>{rs['alt']}</pre>\n"
-                f"<b>Az:</b> <pre>{rs['az']}</pre>\n",
-                reply_markup=ReplyKeyboardRemove(),
-            )
+    tm, location = context.user_data.time, context.user_data.location
+    if tm is None or location is None:
+        return await session_expired(update)
 
-            saver(update, "E2H",
-                  json.dumps({"time": str(context.user_data['tm'].dt), "lat": context.user_data['loc'][0],
-                              "lon": context.user_data['loc'][1]}),
-                  f"{json.dumps(rs)}")
+    latitude, longitude = location
+    rs = await scheduler.submit("eq2hor_batch", user=update.effective_user.id,
+                                ras=[obj[1] for obj in skys], decs=[obj[2] for obj in skys],
+                                time=tm.dt.isot,
+                                longitude=longitude, latitude=latitude, altitude=0, precision=precision)
 
-            return ConversationHandler.END
-        except:
-            await update.message.reply_text(
-                f"Cannot pars coordinates.\n"
-                "Please provide two floats (Ra ,Dec) or name of an object\n"
-                "write cancel to cancel",
-                reply_markup=ReplyKeyboardRemove(),
-                parse_mode="markdown"
-            )
-            return RISESET_OBJECT_ASK
+    answer = ""
+    for obj, alt, az in zip(skys, rs["alt"], rs["az"]):
+        if len(skys) > 1:
+            label = f"Coord {obj[1]} {obj[2]}" if obj[0] == "Coord" else html.escape(obj[0])
+            answer += f"<b>{label}</b>\n"
+        answer += f"<b>Alt:</b> <pre>{alt}</pre>\n" \
+                  f"<b>Az:</b> <pre>{az}</pre>\n"
 
+    await update.message.reply_html(
+        answer,
+        reply_markup=ReplyKeyboardRemove(),
+    )
+    await saver(update, "E2H",
+                json.dumps({"time": str(tm.dt), "lat": latitude, "lon": longitude,
+                            "ra": [obj[1] for obj in skys], "dec": [obj[2] for obj in skys]}),
+                f"{json.dumps(rs)}")
 
+    return ConversationHandler.END
+
+
+@metrics.handler
 async def rise_set(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     variable_reset(context)
     await update.message.reply_text(
@@ -464,6 +549,7 @@ async def rise_set(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return RISESET_TIME_ASK
 
 
+@metrics.handler
 async def rise_set_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     text = update.message.text
     if text.lower() == "cancel":
@@ -475,7 +561,7 @@ async def rise_set_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     if text.lower().strip() == "now":
         tm = Time(now())
-        context.user_data["tm"] = tm
+        context.user_data.time = tm
         await update.message.reply_text(
             "Now give me a location (Latitude ,Longitude): You can share your `location`\n"
             "write cancel to cancel",
@@ -487,7 +573,7 @@ async def rise_set_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE)
     else:
         try:
             tm = Time(auto_parse(text))
-            context.user_data["tm"] = tm
+            context.user_data.time = tm
 
             await update.message.reply_text(
                 "Now give me a location (Latitude ,Longitude): You can share your `location`\n"
@@ -508,6 +594,7 @@ async def rise_set_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return RISESET_TIME_ASK
 
 
+@metrics.handler
 async def rise_set_get_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.message.location is None:
         if update.message.text.lower() == "cancel":
@@ -518,9 +605,9 @@ async def rise_set_get_location(update: Update, context: ContextTypes.DEFAULT_TY
             return ConversationHandler.END
         try:
             latitude, longitude = map(float, update.message.text.split())
-            context.user_data["loc"] = [latitude, longitude]
+            context.user_data.location = latitude, longitude
             await update.message.reply_text(
-                "Now give me a coordinate (Ra ,Dec) or name of an object\n"
+                "Now give me coordinates (Ra ,Dec) or names of objects, one per line\n"
                 "write cancel to cancel",
                 reply_markup=ReplyKeyboardRemove(),
                 parse_mode="markdown"
@@ -538,9 +625,9 @@ async def rise_set_get_location(update: Update, context: ContextTypes.DEFAULT_TY
     else:
         latitude = update.message.location.latitude
         longitude = update.message.location.longitude
-        context.user_data["loc"] = [latitude, longitude]
+        context.user_data.location = latitude, longitude
         await update.message.reply_text(
-            "Now give me a coordinate (Ra ,Dec) or name of an object\n"
+            "Now give me coordinates (Ra ,Dec) or names of objects, one per line\n"
             "write cancel to cancel",
             reply_markup=ReplyKeyboardRemove(),
             parse_mode="markdown"
@@ -548,6 +635,7 @@ async def rise_set_get_location(update: Update, context: ContextTypes.DEFAULT_TY
         return RISESET_OBJECT_ASK
 
 
+@metrics.handler
 async def rise_set_get_sky(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.message.text.lower() == "cancel":
         await update.message.reply_html(
@@ -555,49 +643,59 @@ async def rise_set_get_sky(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             reply_markup=ReplyKeyboardRemove(),
         )
         return ConversationHandler.END
-    try:
-        sky = Object.from_name(update.message.text.strip())
-        rs = sky.rise_set(context.user_data["tm"], *context.user_data["loc"], 0)
-        await update.message.reply_html(
-            f"<b>Rise:</b> <pre>{rs['rise']}</pre>\n"
-            f"<b>Set:</b> <pre>{rs['set']}</pre>\n",
+
+    skys = await resolve(update.message.text, update.effective_user.id)
+    if not skys:
+        await update.message.reply_text(
+            f"Cannot pars coordinates.\n"
+            "Please provide two floats (Ra ,Dec) or name of an object per line\n"
+            f"{await did_you_mean(update.message.text)}"
+            "write cancel to cancel",
             reply_markup=ReplyKeyboardRemove(),
+            parse_mode="markdown"
         )
+        return RISESET_OBJECT_ASK
 
-        saver(update, "Object",
-              json.dumps({"time": str(context.user_data['tm'].dt), "lat": context.user_data['loc'][0],
-                          "lon": context.user_data['loc'][1]}),
-              f"{json.dumps(rs)}")
+    tm, location = context.user_data.time, context.user_data.location
+    if tm is None or location is None:
+        return await session_expired(update)
+
+    latitude, longitude = location
+    rs = await scheduler.submit("rise_set_batch", user=update.effective_user.id,
+                                ras=[obj[1] for obj in skys], decs=[obj[2] for obj in skys],
+                                time=tm.dt.isot,
+                                longitude=longitude, latitude=latitude, altitude=0, precision=precision)
+
+    answer = ""
+    for obj, events in zip(skys, rs):
+        if len(skys) > 1:
+            label = f"Coord {obj[1]} {obj[2]}" if obj[0] == "Coord" else html.escape(obj[0])
+            answer += f"<b>{label}</b>\n"
+        if events["status"] == "never":
+            answer += "<pre>Never rises</pre>\n"
+            continue
+
+        if events["status"] == "circumpolar":
+            answer += "<pre>Circumpolar, never sets</pre>\n"
+        else:
+            answer += f"<b>Rise:</b> <pre>{events['rise']}</pre>\n" \
+                      f"<b>Set:</b> <pre>{events['set']}</pre>\n"
+        answer += f"<b>Transit:</b> <pre>{events['transit']}</pre>\n"
 
-        return ConversationHandler.END
-    except NameResolveError:
-        try:
-            ra, dec = map(float, update.message.text.strip().split())
-            sky = Object(ra, dec)
-            rs = sky.rise_set(context.user_data["tm"], *context.user_data["loc"], 0)
-            await update.message.reply_html(
-                f"<b>Rise:</b> <pre>{rs['rise']}</pre>\n"
-                f"<b>Set:</b> <pre>{rs['set']}</pre>\n",
-                reply_markup=ReplyKeyboardRemove(),
-            )
+    await update.message.reply_html(
+        answer,
+        reply_markup=ReplyKeyboardRemove(),
+    )
 
-            saver(update, "Object",
-                  json.dumps({"time": str(context.user_data['tm'].dt), "lat": context.user_data['loc'][0],
-                              "lon": context.user_data['loc'][1]}),
-                  f"{json.dumps(rs)}")
+    await saver(update, "Object",
+                json.dumps({"time": str(tm.dt), "lat": latitude, "lon": longitude,
+                            "ra": [obj[1] for obj in skys], "dec": [obj[2] for obj in skys]}),
+                f"{json.dumps(rs)}")
 
-            return ConversationHandler.END
-        except:
-            await update.message.reply_text(
-                f"Cannot pars coordinates.\n"
-                "Please provide two floats (Ra ,Dec) or name of an object\n"
-                "write cancel to cancel",
-                reply_markup=ReplyKeyboardRemove(),
-                parse_mode="markdown"
-            )
-            return RISESET_OBJECT_ASK
+    return ConversationHandler.END
 
 
+@metrics.handler
 async def moon(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     variable_reset(context)
     await update.message.reply_text(
@@ -609,6 +707,7 @@ async def moon(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return MOON_TIME_ASK
 
 
+@metrics.handler
 async def moon_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     text = update.message.text
     if text.lower() == "cancel":
@@ -620,7 +719,7 @@ async def moon_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
 
     if text.lower().strip() == "now":
         tm = Time(now())
-        context.user_data["tm"] = tm
+        context.user_data.time = tm
         await update.message.reply_text(
             "Now give me a location (Latitude ,Longitude): You can share your `location`\n"
             "write cancel to cancel",
@@ -632,7 +731,7 @@ async def moon_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     else:
         try:
             tm = Time(auto_parse(text))
-            context.user_data["tm"] = tm
+            context.user_data.time = tm
 
             await update.message.reply_text(
                 "Now give me a location (Latitude ,Longitude): You can share your `location`\n"
@@ -653,6 +752,7 @@ async def moon_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     return MOON_TIME_ASK
 
 
+@metrics.handler
 async def moon_get_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.message.location is None:
         if update.message.text.lower() == "cancel":
@@ -676,7 +776,12 @@ async def moon_get_location(update: Update, context: ContextTypes.DEFAULT_TYPE)
         latitude = update.message.location.latitude
         longitude = update.message.location.longitude
 
-    mn = context.user_data["tm"].moon(longitude, latitude, 0)
+    tm = context.user_data.time
+    if tm is None:
+        return await session_expired(update)
+
+    mn = await scheduler.submit("moon", user=update.effective_user.id, time=tm.dt.isot,
+                                longitude=longitude, latitude=latitude, altitude=0, precision=precision)
 
     await update.message.reply_html(
         f"<b>Rise:</b> <pre>{mn['rise']}</pre>\n"
@@ -685,13 +790,14 @@ async def moon_get_location(update: Update, context: ContextTypes.DEFAULT_TYPE)
         reply_markup=ReplyKeyboardRemove(),
     )
 
-    saver(update, "Moon",
-          json.dumps({"time": str(context.user_data['tm'].dt), "lat": latitude, "lon": longitude}),
-          f"{json.dumps(mn)}")
+    await saver(update, "Moon",
+                json.dumps({"time": str(tm.dt), "lat": latitude, "lon": longitude}),
+                f"{json.dumps(mn)}")
 
     return ConversationHandler.END
 
 
+@metrics.handler
 async def twilight(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     variable_reset(context)
     await update.message.reply_text(
@@ -703,6 +809,7 @@ async def twilight(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return TWILIGHT_TIME_ASK
 
 
+@metrics.handler
 async def twilight_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     text = update.message.text
     if text.lower() == "cancel":
@@ -714,7 +821,7 @@ async def twilight_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     if text.lower().strip() == "now":
         tm = Time(now())
-        context.user_data["tm"] = tm
+        context.user_data.time = tm
         await update.message.reply_text(
             "Now give me a location (Latitude ,Longitude): You can share your `location`\n"
             "write cancel to cancel",
@@ -726,7 +833,7 @@ async def twilight_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE)
     else:
         try:
             tm = Time(auto_parse(text))
-            context.user_data["tm"] = tm
+            context.user_data.time = tm
 
             await update.message.reply_text(
                 "Now give me a location (Latitude ,Longitude): You can share your `location`\n"
@@ -747,6 +854,7 @@ async def twilight_get_time(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return TWILIGHT_TIME_ASK
 
 
+@metrics.handler
 async def twilight_get_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.message.location is None:
         if update.message.text.lower() == "cancel":
@@ -770,7 +878,12 @@ async def twilight_get_location(update: Update, context: ContextTypes.DEFAULT_TY
         latitude = update.message.location.latitude
         longitude = update.message.location.longitude
 
-    tw = context.user_data["tm"].twilight(longitude, latitude, 0)
+    tm = context.user_data.time
+    if tm is None:
+        return await session_expired(update)
+
+    tw = await scheduler.submit("twilight", user=update.effective_user.id, time=tm.dt.isot,
+                                longitude=longitude, latitude=latitude, altitude=0, precision=precision)
 
     await update.message.reply_html(
         f"<pre>Morning: {tw['morning']}</pre>\n"
@@ -778,13 +891,14 @@ async def twilight_get_location(update: Update, context: ContextTypes.DEFAULT_TY
         reply_markup=ReplyKeyboardRemove(),
     )
 
-    saver(update, "Twilight",
-          json.dumps({"time": str(context.user_data['tm'].dt), "lat": latitude, "lon": longitude}),
-          f"{json.dumps(tw)}")
+    await saver(update, "Twilight",
+                json.dumps({"time": str(tm.dt), "lat": latitude, "lon": longitude}),
+                f"{json.dumps(tw)}")
 
     return ConversationHandler.END
 
 
+@metrics.handler
 async def sidereal(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     variable_reset(context)
     await update.message.reply_text(
@@ -796,6 +910,7 @@ async def sidereal(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return SIDEREAL_TIME_ASK
 
 
+@metrics.handler
 async def sidereal_calc(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     text = update.message.text
     if text.lower() == "cancel":
@@ -807,7 +922,7 @@ async def sidereal_calc(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
 
     if text.lower().strip() == "now":
         tm = Time(now())
-        context.user_data["tm"] = tm
+        context.user_data.time = tm
         await update.message.reply_text(
             "Now give me longitude: You can share your `location`\n"
             "write cancel to cancel",
@@ -819,7 +934,7 @@ async def sidereal_calc(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     else:
         try:
             tm = Time(auto_parse(text))
-            context.user_data["tm"] = tm
+            context.user_data.time = tm
 
             await update.message.reply_text(
                 "Now give me longitude: You can share your `location`\n"
@@ -840,6 +955,7 @@ async def sidereal_calc(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     return SIDEREAL_TIME_ASK
 
 
+@metrics.handler
 async def sidereal_get_location_calc(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.message.location is None:
         if update.message.text.lower() == "cancel":
@@ -862,20 +978,25 @@ async def sidereal_get_location_calc(update: Update, context: ContextTypes.DEFAU
     else:
         longitude = update.message.location.longitude
 
-    sr = context.user_data["tm"].sidereal(longitude)
+    tm = context.user_data.time
+    if tm is None:
+        return await session_expired(update)
+
+    sr = await scheduler.submit("sidereal", user=update.effective_user.id, time=tm.dt.isot, longitude=longitude)
 
     await update.message.reply_html(
         f"<pre>{sr}</pre>",
         reply_markup=ReplyKeyboardRemove(),
     )
 
-    saver(update, "Sidereal",
-          json.dumps({"time": str(context.user_data['tm'].dt), "lon": longitude}),
-          f"{json.dumps(sr)}")
+    await saver(update, "Sidereal",
+                json.dumps({"time": str(tm.dt), "lon": longitude}),
+                f"{json.dumps(sr)}")
 
     return ConversationHandler.END
 
 
+@metrics.handler
 async def jd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     variable_reset(context)
     await update.message.reply_text(
@@ -887,6 +1008,7 @@ async def jd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return JD_ASK
 
 
+@metrics.handler
 async def jd_calc(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     text = update.message.text
     if text.lower() == "cancel":
@@ -906,9 +1028,9 @@ async def jd_calc(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             reply_markup=ReplyKeyboardRemove(),
         )
 
-        saver(update, "JD",
-              json.dumps({"time": str(tm.dt)}),
-              f"{json.dumps(jd)}")
+        await saver(update, "JD",
+                    json.dumps({"time": str(tm.dt)}),
+                    f"{json.dumps(jd)}")
 
         return ConversationHandler.END
     else:
@@ -922,9 +1044,9 @@ async def jd_calc(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
                 reply_markup=ReplyKeyboardRemove(),
             )
 
-            saver(update, "JD",
-                  json.dumps({"time": str(tm.dt)}),
-                  f"{json.dumps(jd)}")
+            await saver(update, "JD",
+                        json.dumps({"time": str(tm.dt)}),
+                        f"{json.dumps(jd)}")
 
             return ConversationHandler.END
         except ValueError:
@@ -938,24 +1060,190 @@ async def jd_calc(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return JD_ASK
 
 
+@metrics.handler
 async def done(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Display the gathered info and end the conversation."""
-    user_data = context.user_data
-    if "choice" in user_data:
-        del user_data["choice"]
-
     await update.message.reply_text(
         f"See ya...",
         reply_markup=ReplyKeyboardRemove(),
     )
 
-    user_data.clear()
+    context.user_data.clear()
     return ConversationHandler.END
 
 
-def main() -> None:
-    """Run the bot."""
-    application = Application.builder().token(os.environ['TELEGRAMAPI']).build()
+async def touch(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if isinstance(update, Update) and update.effective_user:
+        context.user_data.touch()
+
+
+async def expired(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Forget what the user gave in a conversation that timed out."""
+    if isinstance(update, Update) and update.effective_user:
+        context.application.drop_user_data(update.effective_user.id)
+
+
+async def forget(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Drop the sessions of users idle for longer than a conversation may last."""
+    timeout = context.application.persistence.timeout
+    for user_id, session in list(context.application.user_data.items()):
+        if monotonic() - session.touched > timeout:
+            context.application.drop_user_data(user_id)
+
+
+async def save_sessions(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Write the sessions and conversation states the application handed to the persistence."""
+    await context.application.persistence.flush()
+
+
+async def purge_names(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Delete expired names from the resolver's SQLite cache."""
+    try:
+        purged = await asyncio.to_thread(resolver.purge)
+        if purged:
+            logger.info("Purged %d expired names", purged)
+    except PeeweeException:
+        logger.exception("Cannot purge the name cache")
+
+
+async def error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Log errors and tell the user when a computation timed out or was not accepted."""
+    if isinstance(context.error, Busy):
+        # The conversation stays where it was, so the user only needs to send the message again
+        logger.info("Rejected a request: %s", context.error.reason)
+        if isinstance(update, Update) and update.message:
+            await update.message.reply_text("I'm busy at the moment, please try again in a few seconds.")
+        return
+
+    if isinstance(context.error, BrokenProcessPool):
+        # The executor already started new workers; the lost calculation may simply be sent again
+        logger.warning("A calculation was lost with its worker: %s", context.error)
+        if isinstance(update, Update) and update.message:
+            await update.message.reply_text("Sorry, that calculation failed. Please send it again.")
+        return
+
+    logger.error("Exception while handling an update", exc_info=context.error)
+    if isinstance(context.error, asyncio.TimeoutError) and isinstance(update, Update) and update.message:
+        await update.message.reply_text(
+            "Sorry, that took too long. Please try again later.",
+            reply_markup=ReplyKeyboardRemove(),
+        )
+
+
+async def startup(application: Application) -> None:
+    await asyncio.to_thread(migrate)
+    snapshot.watch(refresh=os.environ.get("ART_IERS_REFRESH", "1").lower() in ("1", "true", "yes"))
+    metrics.serve()
+    await request_log.start()
+    await executor.warmup()
+
+
+async def shutdown(application: Application) -> None:
+    await weather_client.close()
+    await request_log.close()
+
+
+class UserOrderedProcessor(BaseUpdateProcessor):
+    """Processes up to ``max_concurrent_updates`` updates at once, but one user's updates in arrival order.
+
+    Updates are keyed on their chat and user, like ``ConversationHandler``, so
+    the steps of a conversation never overtake each other. Updates waiting
+    for the same user's earlier ones do not take a slot.
+    """
+
+    def __init__(self, max_concurrent_updates: int) -> None:
+        super().__init__(max_concurrent_updates)
+        self._locks = {}
+
+    @staticmethod
+    def key(update: object):
+        if not isinstance(update, Update):
+            return None
+
+        chat, user = update.effective_chat, update.effective_user
+        return chat.id if chat else None, user.id if user else None
+
+    async def process_update(self, update: object, coroutine) -> None:
+        key = self.key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        # Wait for the user's earlier updates before taking a slot, so a queued user holds at most one
+        lock, waiting = self._locks.get(key, (asyncio.Lock(), 0))
+        self._locks[key] = (lock, waiting + 1)
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            lock, waiting = self._locks[key]
+            if waiting == 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, waiting - 1)
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+class TimedRequest(BaseRequest):
+    """Times every Bot API call of ``request`` into ``art_telegram_seconds``, by method."""
+
+    def __init__(self, request: BaseRequest) -> None:
+        self.request = request
+
+    async def initialize(self) -> None:
+        await self.request.initialize()
+
+    async def shutdown(self) -> None:
+        await self.request.shutdown()
+
+    async def do_request(self, url: str, method: str, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        start = perf_counter()
+        try:
+            return await self.request.do_request(url, method, request_data, read_timeout, write_timeout,
+                                                 connect_timeout, pool_timeout)
+        finally:
+            metrics.registry.observe("art_telegram_seconds", perf_counter() - start, method=url.rsplit("/", 1)[-1])
+
+
+def build_application(token: str = None, base_url: str = None, concurrency: int = None,
+                      request: BaseRequest = None) -> Application:
+    """The bot with all its handlers.
+
+    ``base_url`` is the Bot API server (``ART_TELEGRAM_URL``, default
+    Telegram's), ``request`` replaces the HTTP layer talking to it. With a
+    ``concurrency`` (``ART_CONCURRENCY``) above 1 updates of different users
+    are processed concurrently. With metrics on, Bot API calls other than
+    ``getUpdates`` are timed. Conversations are kept in a ``SessionPersistence``
+    and end after its ``timeout`` of inactivity.
+    """
+    builder = Application.builder().token(token or os.environ['TELEGRAMAPI'])
+    if request is not None:
+        builder = builder.get_updates_request(request)
+    if metrics.registry.enabled:
+        # The pool size of the request the builder makes by default
+        request = TimedRequest(request or HTTPXRequest(connection_pool_size=256))
+    if request is not None:
+        builder = builder.request(request)
+    base_url = base_url or os.environ.get("ART_TELEGRAM_URL")
+    if base_url:
+        builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+
+    concurrency = concurrency or int(os.environ.get("ART_CONCURRENCY", 1))
+    if concurrency > 1:
+        builder = builder.concurrent_updates(UserOrderedProcessor(concurrency))
+
+    persistence = SessionPersistence()
+    application = builder.persistence(persistence).context_types(ContextTypes(user_data=Session)) \
+        .post_init(startup).post_shutdown(shutdown).build()
 
     conv_handler = ConversationHandler(
         entry_points=[
@@ -1102,15 +1390,43 @@ def main() -> None:
                     weather_get_location,
                 )
             ],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, expired)],
         },
         fallbacks=[MessageHandler(filters.Regex("^Done$"), done)],
+        name="art",
+        persistent=True,
+        conversation_timeout=persistence.timeout,
     )
 
+    application.add_handler(TypeHandler(Update, touch), group=-1)
     application.add_handler(conv_handler)
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    application.add_error_handler(error)
+    if application.job_queue is not None:
+        application.job_queue.run_repeating(forget, interval=persistence.timeout)
+        application.job_queue.run_repeating(save_sessions, interval=persistence.update_interval)
+        application.job_queue.run_repeating(purge_names, interval=resolver.purge_interval)
+    metrics.registry.gauge("art_queue_depth", application.update_queue.qsize, queue="updates")
+    return application
+
+
+def main() -> None:
+    """Run the bot, polling for updates or, with ``ART_MODE=webhook``, behind a local webhook listener."""
+    application = build_application()
+    try:
+        if os.environ.get("ART_MODE", "polling") == "webhook":
+            application.run_webhook(
+                listen=os.environ.get("ART_WEBHOOK_LISTEN", "127.0.0.1"),
+                port=int(os.environ.get("ART_WEBHOOK_PORT", 8443)),
+                url_path=os.environ.get("ART_WEBHOOK_PATH", ""),
+                webhook_url=os.environ.get("ART_WEBHOOK_URL"),
+                secret_token=os.environ.get("ART_WEBHOOK_SECRET"),
+                allowed_updates=Update.ALL_TYPES,
+            )
+        else:
+            application.run_polling(allowed_updates=Update.ALL_TYPES)
+    finally:
+        executor.shutdown()
 
 
 if __name__ == "__main__":
-    with db:
-        db.create_tables([Request])
     main()
@@ -0,0 +1,108 @@
+"""Accuracy check of the fast engine against astropy and astroplan.
+
+Compares ``fast.altaz`` with astropy's ``AltAz`` transform, and the rise and
+set times of ``riseset.solve`` with astroplan's, for the bundled catalog at a
+few sites and epochs. Fails (exit status 1) when an error exceeds its bound::
+
+    python tools/accuracy.py
+    python tools/accuracy.py --sites 2 --epochs 2
+"""
+import argparse
+import os
+import sys
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from astropy import units  # noqa: E402
+from astropy.coordinates import AltAz, SkyCoord  # noqa: E402
+from astropy.time import Time as aTime  # noqa: E402
+
+from art import fast, riseset  # noqa: E402
+from art.catalog import catalog  # noqa: E402
+from art.iers import snapshot  # noqa: E402, F401  pins astropy to the local IERS tables
+from art.site import sites  # noqa: E402
+
+# Arcminutes between the fast and the astropy position of a target
+ALTAZ_BOUND = 1.0
+# Arcminutes of astropy altitude a target is off the horizon at a fast rise or set time
+HORIZON_BOUND = 1.0
+# Minutes two rise or set times may differ and still be the same event
+SAME_EVENT = 5.0
+# Days between a target's risings
+SIDEREAL_DAY = 0.9972696
+
+# (longitude, latitude) of DAG, the equator, Cerro Pachon, Lapland and Mauna Kea
+SITES = [(41.2333, 39.7833), (0.0, 0.0), (-70.7367, -30.2407), (25.0, 67.0), (-155.4681, 19.8206)]
+EPOCHS = ["2000-01-01T00:00:00", "2012-06-21T22:00:00", "2020-12-31T12:00:00", "2024-03-15T03:30:00"]
+
+
+def targets():
+    ra, dec = zip(*(catalog.get(name) for name in catalog.names))
+    return np.asarray(ra, dtype=float), np.asarray(dec, dtype=float)
+
+
+def separation(alt1, az1, alt2, az2):
+    """Great circle distance in arcminutes, all angles in degrees."""
+    alt1, az1, alt2, az2 = map(np.radians, (alt1, az1, alt2, az2))
+    cos = np.sin(alt1) * np.sin(alt2) + np.cos(alt1) * np.cos(alt2) * np.cos(az1 - az2)
+    return np.degrees(np.arccos(np.clip(cos, -1, 1))) * 60
+
+
+def altaz_error(ra, dec, epoch: str, longitude: float, latitude: float) -> float:
+    time = aTime(epoch)
+    alt, az = fast.altaz(ra, dec, time.jd, longitude, latitude)
+    frame = AltAz(obstime=time, location=sites.get(longitude, latitude, 0).location)
+    full = SkyCoord(ra=ra, dec=dec, unit=(units.hourangle, units.deg)).transform_to(frame)
+    return float(separation(alt, az, full.alt.degree, full.az.degree).max())
+
+
+def riseset_error(ra, dec, epoch: str, longitude: float, latitude: float) -> tuple:
+    """The worst astropy altitude at a fast event (arcmin) and the worst time difference to astroplan (minutes)."""
+    time = aTime(epoch)
+    site = sites.get(longitude, latitude, 0)
+    sky = SkyCoord(ra=ra, dec=dec, unit=(units.hourangle, units.deg))
+    events = riseset.solve(ra, dec, time.jd, longitude, latitude)
+
+    horizon, minutes = 0.0, 0.0
+    for key, reference in (("rise", site.observer.target_rise_time), ("set", site.observer.target_set_time)):
+        with warnings.catch_warnings():
+            # astroplan warns about every target that never rises or sets
+            warnings.simplefilter("ignore")
+            expected = np.asarray(reference(time, sky, which="nearest").jd, dtype=float)
+
+        found = ~np.isnan(events[key])
+        at = SkyCoord(ra=ra[found], dec=dec[found], unit=(units.hourangle, units.deg))
+        alt = at.transform_to(AltAz(obstime=aTime(events[key][found], format="jd"), location=site.location)).alt
+        horizon = max(horizon, float(np.abs(alt.arcminute).max(initial=0)))
+
+        # Events half a day away tie for nearest, so either solver may answer the one a sidereal day later
+        both = found & ~np.isnan(expected)
+        difference = events[key][both] - expected[both]
+        difference -= np.round(difference / SIDEREAL_DAY) * SIDEREAL_DAY
+        minutes = max(minutes, float((np.abs(difference) * 1440).max(initial=0)))
+
+    return horizon, minutes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python tools/accuracy.py")
+    parser.add_argument("--sites", type=int, default=len(SITES), help="check only the first N sites")
+    parser.add_argument("--epochs", type=int, default=len(EPOCHS), help="check only the first N epochs")
+    args = parser.parse_args()
+
+    ra, dec = targets()
+    failed = False
+    for longitude, latitude in SITES[:args.sites]:
+        for epoch in EPOCHS[:args.epochs]:
+            error = altaz_error(ra, dec, epoch, longitude, latitude)
+            horizon, minutes = riseset_error(ra, dec, epoch, longitude, latitude)
+            ok = error <= ALTAZ_BOUND and horizon <= HORIZON_BOUND and minutes <= SAME_EVENT
+            failed |= not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {latitude:8.3f} {longitude:9.3f} {epoch}  "
+                  f"alt/az {error:5.2f}'  rise/set altitude {horizon:5.2f}'  time {minutes:5.2f} min")
+
+    print(f"bounds: alt/az {ALTAZ_BOUND}', rise/set altitude {HORIZON_BOUND}', same event within {SAME_EVENT} min")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,161 @@
+"""Microbenchmarks of ``art.Time``, ``art.Object``, charts and ``art.Weather``.
+
+Every benchmark is timed with ``timeit`` after one untimed call, so caches are
+warm as in a running bot. Names are never resolved over the network (objects
+are built from coordinates or the bundled catalog) and ``Weather.get`` talks to
+a local stub. Results are written as JSON and can be compared to a baseline::
+
+    python tools/bench.py --output baseline.json
+    python tools/bench.py --baseline baseline.json --threshold 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import timeit
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from art import Object, ObjectCollection, Time, Weather  # noqa: E402
+from art.chart import visibility as visibility_chart  # noqa: E402
+from art.weather import WeatherCache  # noqa: E402
+
+TIME = "2026-10-18T20:00:00"
+SITE = (41.2333, 39.7833, 3170.0)
+BATCH = 100
+
+WEATHER = json.dumps({
+    "weather": [{"description": "clear sky"}],
+    "main": {"temp": 10.0, "pressure": 1013, "humidity": 50},
+    "wind": {"speed": 1.5, "deg": 180},
+}).encode()
+
+
+class WeatherStub(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(WEATHER)))
+        self.end_headers()
+        self.wfile.write(WEATHER)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def benchmarks() -> dict:
+    rng = np.random.default_rng(0)
+    ras, decs = rng.uniform(0, 24, BATCH), rng.uniform(-60, 85, BATCH)
+    time = Time(TIME)
+    m1 = Object(5.5756, 22.0145)
+    many = ObjectCollection(ras, decs)
+    few = ObjectCollection(ras[:10], decs[:10])
+    times, altitudes = few.visibility(time, *SITE, "fast")
+    labels = [f"T{i}" for i in range(10)]
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), WeatherStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    loop = asyncio.new_event_loop()
+    weather = Weather("bench", f"http://127.0.0.1:{server.server_port}", retries=0)
+    cached = WeatherCache(weather)
+
+    return {
+        "time.construct": lambda: Time(TIME),
+        "time.jd": time.jd,
+        "time.sidereal": lambda: time.sidereal(SITE[0]),
+        "time.twilight.full": lambda: time.twilight(*SITE),
+        "time.twilight.fast": lambda: time.twilight(*SITE, "fast"),
+        "time.moon.full": lambda: time.moon(*SITE),
+        "time.moon.fast": lambda: time.moon(*SITE, "fast"),
+        "object.from_name.catalog": lambda: Object.from_name("M 31"),
+        "object.eq2hor.full": lambda: m1.eq2hor(time, *SITE),
+        "object.eq2hor.fast": lambda: m1.eq2hor(time, *SITE, "fast"),
+        f"collection{BATCH}.eq2hor.full": lambda: many.eq2hor(time, *SITE),
+        f"collection{BATCH}.eq2hor.fast": lambda: many.eq2hor(time, *SITE, "fast"),
+        "object.visibility.full": lambda: m1.visibility(time, *SITE),
+        "object.visibility.fast": lambda: m1.visibility(time, *SITE, "fast"),
+        "collection10.visibility.full": lambda: few.visibility(time, *SITE),
+        "collection10.visibility.fast": lambda: few.visibility(time, *SITE, "fast"),
+        "object.rise_set": lambda: m1.rise_set(time, *SITE),
+        f"collection{BATCH}.rise_set.full": lambda: many.rise_set(time, *SITE),
+        f"collection{BATCH}.rise_set.fast": lambda: many.rise_set(time, *SITE, "fast"),
+        "chart.1": lambda: visibility_chart(times, altitudes[:, :1], labels[:1]),
+        "chart.10": lambda: visibility_chart(times, altitudes, labels),
+        "weather.get": lambda: loop.run_until_complete(weather.get(*SITE[:2])),
+        "weather.cache.hit": lambda: loop.run_until_complete(cached.get(*SITE[:2])),
+    }
+
+
+def run(selected: dict, repeat: int) -> dict:
+    results = {}
+    for name, function in selected.items():
+        function()
+        timer = timeit.Timer(function)
+        number, _ = timer.autorange()
+        samples = [total / number for total in timer.repeat(repeat, number)]
+        results[name] = {"median": statistics.median(samples), "min": min(samples), "number": number,
+                         "repeat": repeat}
+        print(f"{name:<32} {results[name]['median'] * 1e3:10.3f} ms", file=sys.stderr)
+
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Names of benchmarks whose median is more than ``threshold`` (a fraction) slower than the baseline."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        ratio = result["median"] / baseline[name]["median"]
+        slower = ratio > 1 + threshold
+        if slower:
+            regressions.append(name)
+        print(f"{'SLOWER' if slower else 'ok    '} {name:<32} {ratio:6.2f}x", file=sys.stderr)
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python tools/bench.py")
+    parser.add_argument("--filter", default="", help="only benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown, 0.2 is 20%%")
+    args = parser.parse_args()
+
+    import astropy
+    import matplotlib
+
+    selected = {name: function for name, function in benchmarks().items() if args.filter in name}
+    report = {
+        "meta": {
+            "date": datetime.utcnow().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "astropy": astropy.__version__,
+            "numpy": np.__version__,
+            "matplotlib": matplotlib.__version__,
+        },
+        "results": run(selected, args.repeat),
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        sys.exit(1 if compare(report["results"], baseline, args.threshold) else 0)
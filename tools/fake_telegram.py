@@ -0,0 +1,234 @@
+"""A local stand-in for the Telegram Bot API to exercise the bot without Telegram.
+
+``FakeTelegram`` answers the Bot API methods the bot uses, records every
+message it sends and delivers user messages either through ``getUpdates`` or,
+once the bot registered a webhook, by posting them to it.
+
+Run the bot against it with a few scripted users::
+
+    python tools/fake_telegram.py --mode webhook --users 20 --concurrency 8
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import urllib.request
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socket import socket
+from urllib.parse import parse_qsl, urlparse
+
+TOKEN = "123456:fake"
+BOT = {"id": 123456, "is_bot": True, "first_name": "ART", "username": "art_bot"}
+
+
+def message(message_id: int, user: int, text: str = None, location: tuple = None) -> dict:
+    """A private message from ``user`` with ``text`` or a ``(latitude, longitude)`` location."""
+    sender = {"id": user, "is_bot": False, "first_name": f"User {user}"}
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": user, "type": "private", "first_name": sender["first_name"]},
+        "from": sender,
+    }
+    if text is not None:
+        message["text"] = text
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    if location is not None:
+        message["location"] = {"latitude": location[0], "longitude": location[1]}
+
+    return message
+
+
+def _params(content_type: str, body: bytes) -> dict:
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+        return {part.get_param("name", header="content-disposition"):
+                part.get_content() if part.get_filename() is None else part.get_filename()
+                for part in message.iter_parts()}
+
+    return dict(parse_qsl(body.decode()))
+
+
+class FakeTelegram(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, token: str = TOKEN, host: str = "127.0.0.1", port: int = 0) -> None:
+        super().__init__((host, port), _Handler)
+        self.token = token
+        self.sent = []
+        self.webhook = None
+        self.secret = None
+
+        self._updates = []
+        self._next_update = 1
+        self._next_message = 1
+        self._changed = threading.Condition()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeTelegram":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def _message_id(self) -> int:
+        with self._changed:
+            self._next_message += 1
+            return self._next_message
+
+    def push(self, user: int, text: str = None, location: tuple = None) -> dict:
+        """Deliver a private message from ``user`` with ``text`` or a ``(latitude, longitude)`` location."""
+        sent = message(self._message_id(), user, text, location)
+        with self._changed:
+            update = {"update_id": self._next_update, "message": sent}
+            self._next_update += 1
+            if self.webhook is None:
+                self._updates.append(update)
+                self._changed.notify_all()
+                return update
+
+        request = urllib.request.Request(self.webhook, json.dumps(update).encode(),
+                                         {"Content-Type": "application/json"})
+        if self.secret:
+            request.add_header("X-Telegram-Bot-Api-Secret-Token", self.secret)
+        urllib.request.urlopen(request, timeout=10).read()
+        return update
+
+    def replies(self, chat: int) -> list:
+        with self._changed:
+            return [params for method, params, _ in self.sent if str(params.get("chat_id")) == str(chat)]
+
+    def wait(self, count: int, timeout: float = 60) -> bool:
+        """Wait until at least ``count`` messages were sent in total."""
+        with self._changed:
+            return self._changed.wait_for(lambda: len(self.sent) >= count, timeout)
+
+    def call(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT
+        if method == "setWebhook":
+            self.webhook, self.secret = params.get("url"), params.get("secret_token")
+            return True
+        if method == "deleteWebhook":
+            self.webhook = None
+            return True
+        if method == "getUpdates":
+            offset, timeout = int(params.get("offset", 0)), float(params.get("timeout", 0))
+            with self._changed:
+                self._updates = [u for u in self._updates if u["update_id"] >= offset]
+                self._changed.wait_for(lambda: self._updates, min(timeout, 1))
+                return list(self._updates)
+        if not method.startswith("send"):
+            return True
+
+        message = {
+            "message_id": self._message_id(),
+            "date": int(time.time()),
+            "chat": {"id": int(params["chat_id"]), "type": "private"},
+            "from": BOT,
+        }
+        if method == "sendMessage":
+            message["text"] = params.get("text", "")
+        elif method == "sendPhoto":
+            file_id = params["photo"] if not str(params["photo"]).startswith("attach://") \
+                else f"photo-{message['message_id']}"
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 640, "height": 480}]
+
+        with self._changed:
+            self.sent.append((method, params, time.perf_counter()))
+            self._changed.notify_all()
+        return message
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeTelegram
+
+    def do_POST(self) -> None:
+        prefix = f"/bot{self.server.token}/"
+        path = urlparse(self.path).path
+        if not path.startswith(prefix):
+            self.send_error(404)
+            return
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        result = self.server.call(path[len(prefix):], _params(self.headers.get("Content-Type", ""), body))
+        content = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def free_port() -> int:
+    with socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _drive(fake: FakeTelegram, users: int, mode: str) -> None:
+    if mode == "webhook":
+        while fake.webhook is None:
+            time.sleep(0.05)
+    else:
+        time.sleep(1)
+
+    start = time.perf_counter()
+    for user in range(1, users + 1):
+        fake.push(user, "/jd")
+    fake.wait(users)
+    for user in range(1, users + 1):
+        fake.push(user, "now")
+    done = fake.wait(2 * users)
+
+    elapsed = time.perf_counter() - start
+    ordered = all(len(fake.replies(user)) == 2 for user in range(1, users + 1))
+    print(json.dumps({"mode": mode, "users": users, "messages": len(fake.sent), "complete": done,
+                      "ordered": ordered, "seconds": round(elapsed, 3)}))
+    os.kill(os.getpid(), signal.SIGINT)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python tools/fake_telegram.py")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=1)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import main as bot
+
+    fake = FakeTelegram().start()
+    application = bot.build_application(token=TOKEN, base_url=fake.url, concurrency=args.concurrency)
+    threading.Thread(target=_drive, args=(fake, args.users, args.mode), daemon=True).start()
+    try:
+        if args.mode == "webhook":
+            port = free_port()
+            application.run_webhook(listen="127.0.0.1", port=port, url_path="telegram",
+                                    webhook_url=f"http://127.0.0.1:{port}/telegram", secret_token="fake")
+        else:
+            application.run_polling()
+    finally:
+        bot.executor.shutdown()
+        fake.stop()
@@ -0,0 +1,69 @@
+"""Cold-import time budget check.
+
+Imports each module in a fresh interpreter ``--repeat`` times and keeps the
+fastest run. Fails (exit status 1) when a module takes longer than its budget
+or loads a dependency it should only load on first use::
+
+    python tools/import_time.py
+    python tools/import_time.py --scale 2 art main
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# module: (budget in seconds, modules it must not import)
+BUDGETS = {
+    "art": (0.05, ["astropy", "astroplan", "matplotlib", "httpx", "peewee"]),
+    "art.catalog": (0.4, ["astropy", "astroplan", "matplotlib"]),
+    "art.metrics": (0.1, ["astropy", "numpy", "peewee", "httpx"]),
+    "art.profiling": (0.1, ["astropy", "numpy", "peewee", "httpx"]),
+    "art.analytics": (0.4, ["astropy", "astroplan", "matplotlib"]),
+    "art.weather": (0.6, ["astropy", "astroplan", "matplotlib"]),
+    "art.compute": (2.0, ["astroplan", "matplotlib"]),
+    "main": (3.0, ["astroplan", "matplotlib"]),
+}
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "modules": sorted(m for m in sys.modules if "." not in m)}}))
+"""
+
+
+def measure(module: str, repeat: int = 5) -> dict:
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", PROBE.format(module=module)], cwd=ROOT, check=True,
+                                capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python tools/import_time.py")
+    parser.add_argument("modules", nargs="*", default=list(BUDGETS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every budget, for slow machines")
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        budget, forbidden = BUDGETS.get(module, (float("inf"), []))
+        budget *= args.scale
+        result = measure(module, args.repeat)
+        loaded = [name for name in forbidden if name in result["modules"]]
+        ok = result["seconds"] <= budget and not loaded
+        failed |= not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {module:<15} {result['seconds']:7.3f}s  budget {budget:.3f}s"
+              + (f"  loads {', '.join(loaded)}" if loaded else ""))
+
+    sys.exit(1 if failed else 0)
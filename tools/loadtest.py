@@ -0,0 +1,246 @@
+"""Load test of the bot's real handlers.
+
+Builds the application with ``main.build_application`` on top of an
+in-process request layer that answers the Bot API without any network, then
+replays scripted conversations of many simulated users at once. Weather
+requests go to a local stub. Prints the throughput and latency percentiles
+per handler as JSON. With ``ART_METRICS_PORT`` set the counters served on
+``/metrics`` are also compared with what the bot counted, and the run fails
+when they differ::
+
+    python tools/loadtest.py --users 2000 --concurrency 64 --scripts visibility,moon,weather
+"""
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import ThreadingHTTPServer
+from time import perf_counter
+
+import numpy as np
+
+from bench import WeatherStub
+from fake_telegram import BOT, TOKEN, message
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update  # noqa: E402
+from telegram.ext import ConversationHandler  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+# Conversations as the messages a user sends; {site} and {targets} vary per user
+SCRIPTS = {
+    "visibility": ["/visibility", "now", "{site}", "{targets}"],
+    "moon": ["/moon", "now", "{site}"],
+    "twilight": ["/twilight", "now", "{site}"],
+    "equatorial": ["/equatorial", "now", "{site}", "{targets}"],
+    "weather": ["/weather", "{site}"],
+    "jd": ["/jd", "now"],
+}
+
+
+class FakeRequest(BaseRequest):
+    """Answers every Bot API call in process, like Telegram would for a private chat."""
+
+    def __init__(self) -> None:
+        self.calls = Counter()
+        self._ids = itertools.count(1)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url: str, method: str, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        name = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        self.calls[name] += 1
+
+        if name == "getMe":
+            result = BOT
+        elif name.startswith("send"):
+            result = {"message_id": next(self._ids), "date": int(time.time()),
+                      "chat": {"id": params["chat_id"], "type": "private"}, "from": BOT}
+            if name == "sendPhoto":
+                # Uploads are in the multipart data, a file id in the parameters
+                photo = params.get("photo") or f"photo-{result['message_id']}"
+                result["photo"] = [{"file_id": photo, "file_unique_id": photo, "width": 640, "height": 480}]
+            else:
+                result["text"] = params.get("text", "")
+        else:
+            result = True
+
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def instrument(application, samples: dict, errors: Counter) -> None:
+    """Time every handler callback of ``application`` into ``samples[callback name]``."""
+    def timed(callback):
+        name = callback.__name__
+
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            start = perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception:
+                errors[name] += 1
+                raise
+            finally:
+                samples[name].append(perf_counter() - start)
+
+        return wrapper
+
+    seen = set()
+    for group in application.handlers.values():
+        for handler in group:
+            handlers = [handler]
+            if isinstance(handler, ConversationHandler):
+                handlers = handler.entry_points + handler.fallbacks + \
+                    [each for state in handler.states.values() for each in state]
+            for each in handlers:
+                if id(each) not in seen:
+                    seen.add(id(each))
+                    each.callback = timed(each.callback)
+
+
+def percentiles(values: list) -> dict:
+    ms = np.asarray(values) * 1e3
+    return {
+        "count": len(values),
+        "p50": round(float(np.percentile(ms, 50)), 2),
+        "p95": round(float(np.percentile(ms, 95)), 2),
+        "p99": round(float(np.percentile(ms, 99)), 2),
+        "max": round(float(ms.max()), 2),
+    }
+
+
+async def simulate(application, users: int, scripts: list, ramp: float, think: float, seed: int) -> dict:
+    from art.catalog import catalog
+
+    rng = random.Random(seed)
+    sites = [f"{rng.uniform(-60, 70):.4f} {rng.uniform(-180, 180):.4f}" for _ in range(50)]
+    updates, messages = itertools.count(1), itertools.count(1)
+    steps = []
+
+    async def user(uid: int) -> None:
+        await asyncio.sleep(ramp * uid / users)
+        variables = {"site": rng.choice(sites), "targets": "\n".join(rng.sample(catalog.names, 2))}
+        for text in SCRIPTS[rng.choice(scripts)]:
+            data = {"update_id": next(updates), "message": message(next(messages), uid, text.format(**variables))}
+            update = Update.de_json(data, application.bot)
+            start = perf_counter()
+            await application.update_processor.process_update(update, application.process_update(update))
+            steps.append(perf_counter() - start)
+            if think:
+                await asyncio.sleep(rng.uniform(0, 2 * think))
+
+    start = perf_counter()
+    await asyncio.gather(*[user(uid) for uid in range(1, users + 1)])
+    elapsed = perf_counter() - start
+    return {"seconds": round(elapsed, 3), "updates": len(steps),
+            "throughput": round(len(steps) / elapsed, 1), "update": percentiles(steps)}
+
+
+def exported(text: str, name: str) -> dict:
+    """The samples of ``name`` in the Prometheus text ``text``, by their labels."""
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith(name + "{") or line.startswith(name + " "):
+            key, value = line.rsplit(" ", 1)
+            samples[key[len(name):]] = float(value)
+    return samples
+
+
+def check_metrics(main) -> dict:
+    """Compare the served counters with what the bot really counted; ``mismatches`` should be empty."""
+    from art import metrics
+
+    text = metrics.registry.render()
+    scheduler = exported(text, "art_scheduler_total")
+    jobs = sum(exported(text, "art_job_seconds_count").values())
+    mismatches = {f"art_scheduler_total{{event=\"{event}\"}}": {"served": scheduler.get(f'{{event="{event}"}}', 0),
+                                                                "counted": value}
+                  for event, value in main.scheduler.stats.items()
+                  if scheduler.get(f'{{event="{event}"}}', 0) != value}
+    # Every accepted job runs once unless it timed out
+    if jobs > main.scheduler.stats["accepted"]:
+        mismatches["art_job_seconds_count"] = {"served": jobs, "counted": main.scheduler.stats["accepted"]}
+    return {"executor": main.executor.kind, "jobs": jobs, "mismatches": mismatches}
+
+
+async def run(args) -> dict:
+    import main
+
+    request = FakeRequest()
+    application = main.build_application(token=TOKEN, concurrency=args.concurrency, request=request)
+    samples, errors = defaultdict(list), Counter()
+    instrument(application, samples, errors)
+
+    await application.initialize()
+    if application.job_queue is not None:
+        await application.job_queue.start()
+    await application.post_init(application)
+    try:
+        report = await simulate(application, args.users, args.scripts.split(","), args.ramp, args.think, args.seed)
+        if main.metrics.registry.enabled:
+            report["metrics"] = check_metrics(main)
+    finally:
+        # What Application.stop does before shutting down
+        if application.job_queue is not None:
+            await application.job_queue.stop(wait=False)
+        await application.update_persistence()
+        await application.post_shutdown(application)
+        await application.shutdown()
+        main.executor.shutdown()
+
+    report.update({
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "handlers": {name: {**percentiles(values), "errors": errors[name]} for name, values in sorted(samples.items())},
+        "bot_calls": dict(request.calls),
+    })
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python tools/loadtest.py")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get("ART_CONCURRENCY", 64)))
+    parser.add_argument("--scripts", default="visibility,moon,weather", help=f"comma separated: {', '.join(SCRIPTS)}")
+    parser.add_argument("--ramp", type=float, default=1.0, help="seconds over which users start")
+    parser.add_argument("--think", type=float, default=0.0, help="mean seconds between a user's messages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), WeatherStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["ART_WEATHER_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ.setdefault("WEATHERAPI", "loadtest")
+    os.environ.setdefault("ART_IERS_REFRESH", "0")
+    # Keep the request log and sessions of the test out of the bot's database
+    scratch = tempfile.mkdtemp(prefix="art-loadtest-")
+    os.environ.setdefault("ART_LOG_DB", os.path.join(scratch, "requests.db"))
+    os.environ.setdefault("ART_LOG_SPILL", os.path.join(scratch, "requests.spill.jsonl"))
+    os.environ.setdefault("ART_SESSION_DB", os.path.join(scratch, "requests.db"))
+
+    result = asyncio.run(run(args))
+    report = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+    if result.get("metrics", {}).get("mismatches"):
+        sys.exit("served metrics do not match the counted ones")